@@ -1,5 +1,5 @@
 import os
-import sys
+import json
 import requests
 import typer
 from typing import Optional
@@ -18,16 +18,55 @@ def _print_result(idx: int, item: dict):
     typer.echo(text.strip())
 
 
+def _ask_streaming(url: str, payload: dict, question: str, show_sources: bool):
+    """Consume the NDJSON stream from /ask: a results line, then answer tokens."""
+    payload = {**payload, "stream": True}
+    try:
+        resp = requests.post(url, json=payload, timeout=60, stream=True)
+        resp.raise_for_status()
+    except Exception as e:
+        typer.echo(f"Request failed: {e}", err=True)
+        raise typer.Exit(code=1)
+
+    lines = (json.loads(line) for line in resp.iter_lines() if line)
+    header = next(lines, {})
+    results = header.get("results", [])
+    if not results:
+        typer.echo("No results returned")
+        raise typer.Exit(code=0)
+
+    typer.echo(f"\n{'='*60}")
+    typer.echo(f"Question: {header.get('question', question)}")
+    typer.echo(f"{'='*60}\n")
+    typer.secho("Answer:", fg="green", bold=True)
+    for event in lines:
+        if "error" in event:
+            typer.echo(f"\n{event['error']}", err=True)
+            break
+        typer.echo(event.get("token", ""), nl=False)
+    typer.echo("\n")
+
+    if show_sources:
+        typer.secho(f"Source Chunks ({len(results)}):", fg="cyan", bold=True)
+        for idx, item in enumerate(results, start=1):
+            _print_result(idx, item)
+
+
 @app.command()
 def ask(
     question: str = typer.Argument(..., help="Question to ask the RAG service"),
     top_k: int = typer.Option(DEFAULT_TOP_K, help="Number of results to return"),
     no_llm: bool = typer.Option(False, "--no-llm", help="Disable LLM answer generation, show only retrieved chunks"),
     show_sources: bool = typer.Option(False, "--show-sources", help="Show source chunks along with answer"),
+    no_cache: bool = typer.Option(False, "--no-cache", help="Bypass the server's answer cache"),
+    stream: bool = typer.Option(False, "--stream", help="Print the answer token-by-token as it is generated"),
 ):
     """Send a question to the /ask endpoint and print the LLM-generated answer."""
     url = API_BASE_URL.rstrip("/") + "/ask"
-    payload = {"question": question, "top_k": top_k, "use_llm": not no_llm}
+    payload = {"question": question, "top_k": top_k, "use_llm": not no_llm, "no_cache": no_cache}
+    if stream and not no_llm:
+        _ask_streaming(url, payload, question, show_sources)
+        return
     try:
         resp = requests.post(url, json=payload, timeout=60)
         resp.raise_for_status()
@@ -0,0 +1,34 @@
+# app/embeddings/_kernels.py
+"""Numeric kernels for embedding batches.
+
+`l2_normalize` runs a Numba-compiled parallel loop when numba is installed and
+falls back to a vectorized NumPy implementation otherwise.
+"""
+import math
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional
+    njit = None
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _l2_normalize_inplace(mat):
+        for i in prange(mat.shape[0]):
+            s = 0.0
+            for j in range(mat.shape[1]):
+                s += mat[i, j] * mat[i, j]
+            inv = 1.0 / math.sqrt(s + 1e-12)
+            for j in range(mat.shape[1]):
+                mat[i, j] *= inv
+
+
+def l2_normalize(mat: np.ndarray) -> np.ndarray:
+    """L2-normalize the rows of a contiguous (N, D) float32 matrix in place and return it."""
+    if njit is not None:
+        _l2_normalize_inplace(mat)
+    else:
+        norms = np.sqrt(np.einsum("ij,ij->i", mat, mat) + 1e-12)
+        mat /= norms[:, None]
+    return mat
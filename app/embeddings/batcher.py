@@ -0,0 +1,178 @@
+# app/embeddings/batcher.py
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Set, Tuple
+import httpx
+import numpy as np
+from app.embeddings.ollama_embeddings import aembed_texts
+
+logger = logging.getLogger(__name__)
+
+# Consecutive successful requests before the batch size grows by one
+EMBED_BATCH_GROW_AFTER = int(os.getenv("EMBED_BATCH_GROW_AFTER", "10"))
+# Attempts per request once the batch size is not in question (aembed_texts' default)
+FULL_RETRIES = 3
+
+
+def _is_overload(exc: Exception) -> bool:
+    """True for errors that suggest the batch was too large for the backend."""
+    if isinstance(exc, httpx.TimeoutException):
+        return True
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return False
+
+
+class AdaptiveBatchSize:
+    """Batch-size controller: halve on overload, grow by one after
+    `grow_after` consecutive successes, never exceeding `max_size`.
+
+    The current size is persisted to `state_path` (JSON) so restarts resume
+    from the last size that worked.
+    """
+
+    def __init__(self, max_size: int, grow_after: int = EMBED_BATCH_GROW_AFTER, state_path: Optional[str] = None):
+        self.max_size = max(1, max_size)
+        self.grow_after = max(1, grow_after)
+        self.state_path = state_path
+        self.size = self._load()
+        self._successes = 0
+
+    def _load(self) -> int:
+        if self.state_path and os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, "r", encoding="utf-8") as fh:
+                    return max(1, min(self.max_size, int(json.load(fh)["batch_size"])))
+            except Exception as e:
+                logger.warning(f"Could not read batch size state {self.state_path}: {e}")
+        return self.max_size
+
+    def _save(self):
+        if not self.state_path:
+            return
+        try:
+            with open(self.state_path, "w", encoding="utf-8") as fh:
+                json.dump({"batch_size": self.size}, fh)
+        except Exception as e:
+            logger.warning(f"Could not persist batch size state {self.state_path}: {e}")
+
+    def on_success(self):
+        self._successes += 1
+        if self._successes >= self.grow_after and self.size < self.max_size:
+            self.size += 1
+            self._successes = 0
+            self._save()
+
+    def on_overload(self):
+        self._successes = 0
+        if self.size > 1:
+            self.size = max(1, self.size // 2)
+            logger.warning(f"Embedding backend overloaded; batch size reduced to {self.size}")
+            self._save()
+
+
+class BatchedEmbedder:
+    """Coalesces embed requests from concurrent callers into batched Ollama calls.
+
+    Texts are queued until either a full batch is pending or `wait_ms` has
+    elapsed since the first one arrived; the group is then sent to /api/embed
+    and each caller receives its own vector. The batch size adapts between 1
+    and `max_batch` depending on whether the backend keeps up.
+    """
+
+    def __init__(self, model: str, max_batch: int = 16, wait_ms: int = 50, state_path: Optional[str] = None):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.wait_ms = wait_ms
+        self.sizer = AdaptiveBatchSize(self.max_batch, state_path=state_path)
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: Set[asyncio.Task] = set()
+        # text -> future of a pending/in-flight request, so concurrent duplicates share it
+        self._by_text: Dict[str, asyncio.Future] = {}
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Embed a single text, sharing the HTTP request with other pending callers."""
+        if not text or not text.strip():
+            raise ValueError("Cannot embed empty text")
+        existing = self._by_text.get(text)
+        if existing is not None:
+            return await asyncio.shield(existing)
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._by_text[text] = fut
+        fut.add_done_callback(lambda _f, t=text: self._by_text.pop(t, None))
+        self._pending.append((text, fut))
+        if len(self._pending) >= self.sizer.size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.wait_ms / 1000.0, self._flush)
+        return await fut
+
+    async def embed_many(self, texts: List[str]) -> List[np.ndarray]:
+        """Embed several texts through the shared queue, preserving order."""
+        results = await asyncio.gather(*[self.embed(t) for t in texts], return_exceptions=True)
+        for res in results:
+            if isinstance(res, BaseException):
+                raise res
+        return list(results)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+        task = asyncio.ensure_future(self._run(pending))
+        # keep a reference so the task isn't garbage collected mid-flight
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _run(self, pending: List[Tuple[str, asyncio.Future]]):
+        texts = [text for text, _ in pending]
+        logger.debug(f"BatchedEmbedder flushing {len(texts)} texts")
+        try:
+            vectors = await self._embed_adaptive(texts)
+        except Exception as e:
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for (_, fut), vec in zip(pending, vectors):
+            if not fut.done():
+                fut.set_result(vec)
+
+    async def _embed_adaptive(self, texts: List[str]) -> List[np.ndarray]:
+        """Embed texts in requests of the current adaptive size; on overload,
+        shrink the size and retry the remaining tail."""
+        vectors: List[np.ndarray] = []
+        pos = 0
+        full_retry = False
+        while pos < len(texts):
+            size = self.sizer.size
+            part = texts[pos:pos + size]
+            # fail fast while the size can still shrink; full retries at size 1
+            retries = FULL_RETRIES if size == 1 or full_retry else 1
+            try:
+                out = await aembed_texts(part, model=self.model, retries=retries)
+                if len(out) != len(part):
+                    raise ValueError(f"Expected {len(part)} embeddings, got {len(out)}")
+            except Exception as e:
+                if size > 1 and _is_overload(e):
+                    self.sizer.on_overload()
+                    full_retry = False
+                    continue
+                if retries < FULL_RETRIES:
+                    # connection resets and protocol errors say nothing about the
+                    # batch size: resend the same part with the full retry budget
+                    full_retry = True
+                    continue
+                raise
+            full_retry = False
+            self.sizer.on_success()
+            vectors.extend(out)
+            pos += len(part)
+        return vectors
@@ -1,4 +1,5 @@
 # app/embeddings/cache.py
+import os
 import sqlite3
 import hashlib
 import numpy as np
@@ -9,89 +10,306 @@ from typing import Dict, List, Optional, Tuple
 logger = logging.getLogger(__name__)
 
 DEFAULT_DB = "embeddings_cache.sqlite3"
+# Matrix files grow by at least this many rows at a time
+MATRIX_GROW_ROWS = 1024
 
 def compute_hash(text: str, model: str) -> str:
+    return hashlib.sha256(model.encode("utf-8") + b"\x00" + text.encode("utf-8")).hexdigest()
+
+def compute_hashes(texts: List[str], model: str) -> List[str]:
+    """Hash a batch of texts, encoding the model prefix only once."""
+    prefix = model.encode("utf-8") + b"\x00"
+    sha256 = hashlib.sha256
+    return [sha256(prefix + t.encode("utf-8")).hexdigest() for t in texts]
+
+def compute_answer_key(question: str, context_texts: List[str], model: str) -> str:
+    """Key for a generated answer: the same question over the same context with the same model.
+
+    Keyed on the context text itself, in prompt order: chunk ids are positional,
+    so a re-uploaded, edited document keeps its ids while its text changes.
+    """
     h = hashlib.sha256()
-    h.update(model.encode("utf-8"))
-    h.update(b"\x00")
-    h.update(text.encode("utf-8"))
+    for part in [model, question, *context_texts]:
+        data = part.encode("utf-8")
+        # length prefix keeps part boundaries unambiguous
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
     return h.hexdigest()
 
+
+class _MatrixFile:
+    """Append-only (rows, dim) matrix stored in a memory-mapped file."""
+
+    def __init__(self, path: str, dim: int, rows: int = 0, dtype=np.float32):
+        self.path = path
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.rows = rows  # rows in use; the file may be larger (preallocated)
+        self.capacity = 0
+        self.mm: Optional[np.memmap] = None
+        self._map(max(rows, 1))
+
+    def _map(self, min_rows: int):
+        row_bytes = self.dim * self.dtype.itemsize
+        existing = os.path.getsize(self.path) // row_bytes if os.path.exists(self.path) else 0
+        capacity = max(existing, min_rows, MATRIX_GROW_ROWS)
+        if capacity > existing:
+            with open(self.path, "ab"):
+                pass
+            os.truncate(self.path, capacity * row_bytes)
+        if self.mm is not None:
+            self.mm.flush()
+        self.mm = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+        self.capacity = capacity
+
+    def ensure_rows(self, rows: int):
+        """Remap if another writer has grown the file past the current mapping."""
+        if rows > self.capacity:
+            self._map(rows)
+
+    def append(self, vectors: np.ndarray) -> int:
+        """Write vectors after the last used row and return the first row index.
+
+        Callers set `rows` from the database first (under its write lock), since
+        other `Cache` instances or processes may have appended since this one.
+        """
+        n = vectors.shape[0]
+        if self.rows + n > self.capacity:
+            self._map(max(self.capacity * 2, self.rows + n))
+        start = self.rows
+        self.mm[start:start + n] = vectors
+        self.rows += n
+        return start
+
+    def take(self, row_indices: np.ndarray) -> np.ndarray:
+        # fancy indexing copies out of the map, so results stay valid after a remap
+        return self.mm[row_indices]
+
+    def flush(self):
+        if self.mm is not None:
+            self.mm.flush()
+
+
+def _quantize(matrix: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-row int8 quantization: returns (int8 rows, float32 scales).
+
+    No zero point: the worker L2-normalizes vectors before caching them, so
+    each row's components lie in [-1, 1] and are centred on zero, and scaling
+    by max |x| already spans the int8 range. An asymmetric scale/zero-point
+    pair would only pay off for rows with a large common offset.
+    """
+    scales = np.abs(matrix).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+
 class Cache:
-    def __init__(self, db_path: str = DEFAULT_DB):
+    """Embedding cache: SQLite maps hash -> (dim, row) and vectors live in one
+    memory-mapped matrix file per dimension next to the database.
+
+    With `quantize=True` new vectors are stored as int8 with a per-row scale
+    (4x smaller); rows written as float32 remain readable either way.
+
+    Several instances (or processes) may share a database: rows are allocated
+    under SQLite's write lock, and readers remap files grown by other writers.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB, quantize: bool = False):
         self.db_path = db_path
+        self.quantize = quantize
         self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         self._lock = threading.Lock()
+        # keyed by (dim, quantized)
+        self._matrices: Dict[Tuple[int, bool], _MatrixFile] = {}
         self._init_db()
+        self._open_matrices()
+        self._migrate_legacy_table()
 
     def _init_db(self):
         with self.conn:
             self.conn.execute("PRAGMA journal_mode=WAL;")
+            # WAL + NORMAL skips the per-transaction fsync that FULL requires
+            self.conn.execute("PRAGMA synchronous=NORMAL;")
+            self.conn.execute("PRAGMA temp_store=MEMORY;")
+            self.conn.execute("PRAGMA mmap_size=268435456;")  # 256 MiB
+            self.conn.execute("PRAGMA cache_size=-65536;")  # 64 MiB
+            # bound WAL growth for long-running workers
+            self.conn.execute("PRAGMA wal_autocheckpoint=1000;")
             self.conn.execute(
                 """
-                CREATE TABLE IF NOT EXISTS embeddings_cache (
+                CREATE TABLE IF NOT EXISTS embedding_rows (
                     id INTEGER PRIMARY KEY,
                     model TEXT NOT NULL,
                     hash TEXT NOT NULL UNIQUE,
                     text TEXT,
-                    dim INTEGER,
-                    embedding BLOB,
+                    dim INTEGER NOT NULL,
+                    row_idx INTEGER NOT NULL,
+                    scale REAL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                """
+            )
+            # scale is NULL for float32 rows; add it to tables created before quantization
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(embedding_rows)")}
+            if "scale" not in columns:
+                self.conn.execute("ALTER TABLE embedding_rows ADD COLUMN scale REAL")
+            # next-free-row lookup in bulk_set: MAX(row_idx) per matrix file from the index
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embedding_rows_slot "
+                "ON embedding_rows(dim, (scale IS NOT NULL), row_idx)"
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS answer_cache (
+                    key TEXT PRIMARY KEY,
+                    answer TEXT NOT NULL,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
                 """
             )
 
+    def _matrix_path(self, dim: int, quantized: bool) -> str:
+        return f"{os.path.splitext(self.db_path)[0]}.{dim}d.{'i8' if quantized else 'f32'}"
+
+    def _open_matrices(self):
+        rows = self.conn.execute(
+            "SELECT dim, scale IS NOT NULL, MAX(row_idx) + 1 FROM embedding_rows GROUP BY dim, scale IS NOT NULL"
+        ).fetchall()
+        for dim, quantized, used in rows:
+            self._matrix(dim, bool(quantized), used)
+
+    def _matrix(self, dim: int, quantized: bool, rows: int = 0) -> _MatrixFile:
+        key = (dim, quantized)
+        mf = self._matrices.get(key)
+        if mf is None:
+            mf = self._matrices[key] = _MatrixFile(
+                self._matrix_path(dim, quantized), dim, rows, dtype=np.int8 if quantized else np.float32
+            )
+        return mf
+
+    def _migrate_legacy_table(self):
+        """Move vectors from the old BLOB-per-row table into the matrix files."""
+        has_legacy = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'embeddings_cache'"
+        ).fetchone()
+        if not has_legacy:
+            return
+        legacy = self.conn.execute("SELECT hash, model, text, dim, embedding FROM embeddings_cache").fetchall()
+        items = [
+            (hsh, model, text, np.frombuffer(blob, dtype=np.float32))
+            for hsh, model, text, _, blob in legacy
+            if blob
+        ]
+        # stay below SQLite's bound-parameter limit in bulk_set's IN (...) lookup
+        for i in range(0, len(items), 500):
+            self.bulk_set(items[i:i + 500])
+        with self.conn:
+            self.conn.execute("DROP TABLE embeddings_cache")
+        logger.info(f"Migrated {len(items)} embeddings from legacy cache table")
+
     def bulk_get(self, hashes: List[str]) -> Dict[str, np.ndarray]:
         if not hashes:
             return {}
         placeholders = ",".join("?" for _ in hashes)
-        q = f"SELECT hash, dim, embedding FROM embeddings_cache WHERE hash IN ({placeholders})"
-        with self._lock:
-            cur = self.conn.execute(q, hashes)
-            rows = cur.fetchall()
+        q = f"SELECT hash, dim, row_idx, scale FROM embedding_rows WHERE hash IN ({placeholders})"
         out: Dict[str, np.ndarray] = {}
-        for hsh, dim, blob in rows:
-            arr = np.frombuffer(blob, dtype=np.float32)
-            if dim is not None:
-                arr = arr.reshape((dim,))
-            out[hsh] = arr
+        with self._lock:
+            rows = self.conn.execute(q, hashes).fetchall()
+            groups: Dict[Tuple[int, bool], List[Tuple[str, int, Optional[float]]]] = {}
+            for hsh, dim, row_idx, scale in rows:
+                groups.setdefault((dim, scale is not None), []).append((hsh, row_idx, scale))
+            # one gather per matrix file instead of decoding row blobs
+            for key, entries in groups.items():
+                if key not in self._matrices and not os.path.exists(self._matrix_path(*key)):
+                    continue
+                mf = self._matrix(*key)
+                # rows may have been appended by another writer since this file was mapped
+                mf.ensure_rows(max(r for _, r, _ in entries) + 1)
+                block = mf.take(np.fromiter((r for _, r, _ in entries), dtype=np.int64, count=len(entries)))
+                if key[1]:
+                    # dequantize the whole block at once
+                    scales = np.fromiter((sc for _, _, sc in entries), dtype=np.float32, count=len(entries))
+                    block = block.astype(np.float32) * scales[:, None]
+                for i, (hsh, _, _) in enumerate(entries):
+                    out[hsh] = block[i]
         logger.info(f"Cache bulk_get: requested {len(hashes)}, found {len(out)} cached embeddings")
         return out
 
     def set(self, hash_: str, model: str, text: str, vector: np.ndarray):
-        dim = int(vector.size)
-        blob = vector.astype(np.float32).tobytes()
-        with self._lock:
-            try:
-                with self.conn:
-                    self.conn.execute(
-                        "INSERT INTO embeddings_cache (model, hash, text, dim, embedding) VALUES (?, ?, ?, ?, ?)",
-                        (model, hash_, text, dim, blob),
-                    )
-            except sqlite3.IntegrityError:
-                # already exists
-                pass
+        self.bulk_set([(hash_, model, text, vector)])
 
     def bulk_set(self, items: List[Tuple[str, str, str, np.ndarray]]):
         if not items:
             return
+        params = []
         with self._lock:
-            cur = self.conn.cursor()
-            for hash_, model, text, vector in items:
-                dim = int(vector.size)
-                blob = vector.astype(np.float32).tobytes()
-                try:
-                    cur.execute(
-                        "INSERT INTO embeddings_cache (model, hash, text, dim, embedding) VALUES (?, ?, ?, ?, ?)",
-                        (model, hash_, text, dim, blob),
+            # BEGIN IMMEDIATE takes SQLite's write lock up front, so row allocation
+            # below is serialized with every other Cache on this database
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # skip hashes already stored (or repeated in this batch) before appending rows
+                placeholders = ",".join("?" for _ in items)
+                existing = {
+                    r[0] for r in self.conn.execute(
+                        f"SELECT hash FROM embedding_rows WHERE hash IN ({placeholders})",
+                        [it[0] for it in items],
                     )
-                except sqlite3.IntegrityError:
-                    continue
-            self.conn.commit()
-        logger.info(f"Cache bulk_set: stored {len(items)} embeddings")
+                }
+                by_dim: Dict[int, List[Tuple[str, str, str, np.ndarray]]] = {}
+                for hash_, model, text, vector in items:
+                    if hash_ in existing:
+                        continue
+                    existing.add(hash_)
+                    by_dim.setdefault(int(vector.size), []).append((hash_, model, text, vector))
+
+                for dim, group in by_dim.items():
+                    matrix = np.stack([np.asarray(v, dtype=np.float32).reshape(dim) for _, _, _, v in group])
+                    if self.quantize:
+                        matrix, scales = _quantize(matrix)
+                        row_scales = scales.tolist()
+                    else:
+                        row_scales = [None] * len(group)
+                    mf = self._matrix(dim, self.quantize)
+                    # next free row as committed by any writer, not this instance's memory of it
+                    used = self.conn.execute(
+                        "SELECT MAX(row_idx) + 1 FROM embedding_rows WHERE dim = ? AND (scale IS NOT NULL) = ?",
+                        (dim, self.quantize),
+                    ).fetchone()[0]
+                    mf.rows = used or 0
+                    start = mf.append(matrix)
+                    params.extend(
+                        (model, hash_, text, dim, start + i, row_scales[i])
+                        for i, (hash_, model, text, _) in enumerate(group)
+                    )
+                if params:
+                    self.conn.executemany(
+                        "INSERT INTO embedding_rows (model, hash, text, dim, row_idx, scale) VALUES (?, ?, ?, ?, ?, ?)",
+                        params,
+                    )
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        logger.info(f"Cache bulk_set: stored {len(params)} of {len(items)} embeddings")
+
+    def get_answer(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT answer FROM answer_cache WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_answer(self, key: str, answer: str):
+        with self._lock:
+            with self.conn:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO answer_cache (key, answer) VALUES (?, ?)",
+                    (key, answer),
+                )
 
     def close(self):
         try:
+            for mf in self._matrices.values():
+                mf.flush()
             self.conn.close()
         except Exception:
-            pass
\ No newline at end of file
+            pass
@@ -1,29 +1,73 @@
 # app/embeddings/ollama_embeddings.py
 import os
+import importlib.util
 import time
+import asyncio
 import numpy as np
 from typing import List
-import requests
+import httpx
+import orjson
 import logging
 
 logger = logging.getLogger(__name__)
 
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
-# Ollama embeddings endpoint
-OLLAMA_EMBED_PATH = os.getenv("OLLAMA_EMBED_PATH", "/api/embeddings")
+# Ollama batch embeddings endpoint (accepts a list of inputs)
+OLLAMA_EMBED_PATH = os.getenv("OLLAMA_EMBED_PATH", "/api/embed")
+# Legacy single-text endpoint, used only as a fallback when the batch endpoint errors
+OLLAMA_LEGACY_EMBED_PATH = os.getenv("OLLAMA_LEGACY_EMBED_PATH", "/api/embeddings")
 OLLAMA_API_KEY = os.getenv("OLLAMA_API_KEY", None)
 DEFAULT_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "30"))
+# HTTP/2 is only negotiated over TLS and needs the optional h2 package; opt-in
+OLLAMA_HTTP2 = os.getenv("OLLAMA_HTTP2", "0") == "1"
+if OLLAMA_HTTP2 and importlib.util.find_spec("h2") is None:
+    logger.warning("OLLAMA_HTTP2=1 but the h2 package is not installed; using HTTP/1.1")
+    OLLAMA_HTTP2 = False
+# How long Ollama keeps the model loaded after a request (Ollama's default is 5m);
+# a cold reload costs far more than the embedding itself
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "1h")
 
-def _build_request(text: str, model: str):
-    url = OLLAMA_URL.rstrip("/") + OLLAMA_EMBED_PATH
-    headers = {"Content-Type": "application/json"}
-    if OLLAMA_API_KEY:
-        headers["Authorization"] = f"Bearer {OLLAMA_API_KEY}"
+_LIMITS = httpx.Limits(max_keepalive_connections=40, max_connections=100, keepalive_expiry=30.0)
+# Shared pooled clients: connections are kept alive across calls instead of
+# paying TCP/TLS setup per request. The sync client serves query-time callers,
+# the async client serves the embedding workers.
+_client = httpx.Client(timeout=DEFAULT_TIMEOUT, limits=_LIMITS)
+_async_client = httpx.AsyncClient(http2=OLLAMA_HTTP2, timeout=DEFAULT_TIMEOUT, limits=_LIMITS)
+
+# Status codes meaning the server predates /api/embed
+_FALLBACK_STATUS = (404, 405, 501)
+
+# Request URLs and headers are fixed for the process lifetime; build them once
+_EMBED_URL = OLLAMA_URL.rstrip("/") + OLLAMA_EMBED_PATH
+_LEGACY_EMBED_URL = OLLAMA_URL.rstrip("/") + OLLAMA_LEGACY_EMBED_PATH
+_HEADERS = {"Content-Type": "application/json"}
+if OLLAMA_API_KEY:
+    _HEADERS["Authorization"] = f"Bearer {OLLAMA_API_KEY}"
+
+def _build_request(texts: List[str], model: str):
+    # Ollama /api/embed endpoint takes "input" as a list of strings
+    payload = {"model": model, "input": texts, "keep_alive": OLLAMA_KEEP_ALIVE}
+    return _EMBED_URL, _HEADERS, payload
+
+def _build_legacy_request(text: str, model: str):
     # Ollama /api/embeddings endpoint uses "prompt" not "input"
-    payload = {"model": model, "prompt": text}
-    return url, headers, payload
+    payload = {"model": model, "prompt": text, "keep_alive": OLLAMA_KEEP_ALIVE}
+    return _LEGACY_EMBED_URL, _HEADERS, payload
 
-def _parse_response(resp_json) -> List[float]:
+def _parse_response(resp_json) -> List[List[float]]:
+    # Ollama /api/embed returns {"embeddings": [[...], [...]]} (one vector per input)
+    if isinstance(resp_json, dict):
+        if "embeddings" in resp_json:
+            embs = resp_json["embeddings"]
+            if embs and isinstance(embs, list) and all(e for e in embs):
+                return embs
+            logger.error(f"Empty or invalid embeddings in response: {resp_json}")
+        if "data" in resp_json:
+            return resp_json["data"]
+    logger.error(f"Unexpected Ollama response format: {resp_json}")
+    raise ValueError(f"Unexpected Ollama response format: {resp_json}")
+
+def _parse_legacy_response(resp_json) -> List[float]:
     # Ollama embeddings endpoint returns {"embedding": [...]} (single vector)
     if isinstance(resp_json, dict):
         if "embedding" in resp_json:
@@ -36,49 +80,140 @@ def _parse_response(resp_json) -> List[float]:
     logger.error(f"Unexpected Ollama response format: {resp_json}")
     raise ValueError(f"Unexpected Ollama response format: {resp_json}")
 
-def embed_texts(texts: List[str], model: str = "bge-m3", retries: int = 3, backoff: float = 1.0) -> List[np.ndarray]:
-    if not texts:
-        return []
-    
+def _prepare_inputs(texts: List[str]) -> List[str]:
     # Filter out empty texts
-    valid_texts = [(idx, text) for idx, text in enumerate(texts) if text and text.strip()]
+    valid_texts = [text for text in texts if text and text.strip()]
     if len(valid_texts) != len(texts):
         logger.warning(f"Filtered out {len(texts) - len(valid_texts)} empty text(s) from embedding request")
-    
     if not valid_texts:
         logger.warning("All texts were empty after filtering")
-        return []
-    
-    logger.info(f"Embedding {len(valid_texts)} texts with model {model}")
+    return [text.strip() for text in valid_texts]
+
+def _vectors_from_response(resp: httpx.Response, inputs: List[str]) -> List[List[float]]:
+    resp.raise_for_status()
+    resp_data = orjson.loads(resp.content)
+    logger.debug(f"Ollama response status: {resp.status_code}, keys: {list(resp_data.keys())}")
+    vectors = _parse_response(resp_data)
+    if len(vectors) != len(inputs):
+        raise ValueError(f"Ollama returned {len(vectors)} embeddings for {len(inputs)} inputs")
+    return vectors
+
+def _legacy_vector_from_response(resp: httpx.Response, text: str) -> np.ndarray:
+    resp.raise_for_status()
+    resp_data = orjson.loads(resp.content)
+    vector = _parse_legacy_response(resp_data)
+    # Validate vector is not empty
+    if not vector or len(vector) == 0:
+        logger.error(f"Empty embedding in response. Full response: {resp_data}")
+        raise ValueError(f"Ollama returned empty embedding for text: {text[:50]}...")
+    return np.fromiter(vector, dtype=np.float32, count=len(vector))
+
+def _embed_legacy(texts: List[str], model: str, retries: int, backoff: float) -> List[np.ndarray]:
+    """Embed texts one at a time via /api/embeddings (older Ollama servers)."""
     embeddings: List[np.ndarray] = []
-    for list_idx, (orig_idx, text) in enumerate(valid_texts):
+    for list_idx, text in enumerate(texts):
         attempt = 0
         while True:
             attempt += 1
             try:
-                url, headers, payload = _build_request(text.strip(), model)
+                url, headers, payload = _build_legacy_request(text, model)
                 logger.debug(f"Ollama request: POST {url} with payload: {payload}")
-                resp = requests.post(url, json=payload, headers=headers, timeout=DEFAULT_TIMEOUT)
-                resp.raise_for_status()
-                
-                resp_data = resp.json()
-                logger.debug(f"Ollama response status: {resp.status_code}, keys: {list(resp_data.keys())}")
-                
-                vector = _parse_response(resp_data)
-                
-                # Validate vector is not empty
-                if not vector or len(vector) == 0:
-                    logger.error(f"Empty embedding in response. Full response: {resp_data}")
-                    raise ValueError(f"Ollama returned empty embedding for text: {text[:50]}...")
-                
-                embeddings.append(np.array(vector, dtype=np.float32))
-                logger.debug(f"Successfully embedded text, dimension: {len(vector)}")
+                resp = _client.post(url, json=payload, headers=headers)
+                embeddings.append(_legacy_vector_from_response(resp, text))
                 break
             except Exception as e:
-                logger.warning(f"Embedding attempt {attempt} failed for item {list_idx+1}/{len(valid_texts)}: {e}")
+                logger.warning(f"Embedding attempt {attempt} failed for item {list_idx+1}/{len(texts)}: {e}")
                 if attempt >= retries:
-                    logger.error(f"Embedding failed after {retries} retries for item {list_idx+1}/{len(valid_texts)}")
+                    logger.error(f"Embedding failed after {retries} retries for item {list_idx+1}/{len(texts)}")
                     raise
                 time.sleep(backoff * (2 ** (attempt - 1)))
+    return embeddings
+
+async def _aembed_legacy(texts: List[str], model: str, retries: int, backoff: float) -> List[np.ndarray]:
+    """Async variant of `_embed_legacy`."""
+    embeddings: List[np.ndarray] = []
+    for list_idx, text in enumerate(texts):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                url, headers, payload = _build_legacy_request(text, model)
+                resp = await _async_client.post(url, json=payload, headers=headers)
+                embeddings.append(_legacy_vector_from_response(resp, text))
+                break
+            except Exception as e:
+                logger.warning(f"Embedding attempt {attempt} failed for item {list_idx+1}/{len(texts)}: {e}")
+                if attempt >= retries:
+                    logger.error(f"Embedding failed after {retries} retries for item {list_idx+1}/{len(texts)}")
+                    raise
+                await asyncio.sleep(backoff * (2 ** (attempt - 1)))
+    return embeddings
+
+def embed_texts(texts: List[str], model: str = "bge-m3", retries: int = 3, backoff: float = 1.0) -> List[np.ndarray]:
+    if not texts:
+        return []
+    inputs = _prepare_inputs(texts)
+    if not inputs:
+        return []
+
+    logger.info(f"Embedding {len(inputs)} texts with model {model}")
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            url, headers, payload = _build_request(inputs, model)
+            logger.debug(f"Ollama request: POST {url} with {len(inputs)} inputs")
+            resp = _client.post(url, json=payload, headers=headers)
+            if resp.status_code in _FALLBACK_STATUS:
+                logger.warning(f"Batch endpoint {url} returned {resp.status_code}; falling back to {OLLAMA_LEGACY_EMBED_PATH}")
+                return _embed_legacy(inputs, model, retries, backoff)
+            vectors = _vectors_from_response(resp, inputs)
+            break
+        except Exception as e:
+            logger.warning(f"Batch embedding attempt {attempt} failed for {len(inputs)} texts: {e}")
+            if attempt >= retries:
+                logger.error(f"Batch embedding failed after {retries} retries")
+                raise
+            time.sleep(backoff * (2 ** (attempt - 1)))
+
+    # one (N, D) float32 allocation for the whole batch; rows are views into it
+    embeddings = list(np.asarray(vectors, dtype=np.float32))
+    logger.info(f"Successfully embedded {len(embeddings)} texts")
+    return embeddings
+
+async def aembed_texts(texts: List[str], model: str = "bge-m3", retries: int = 3, backoff: float = 1.0) -> List[np.ndarray]:
+    """Async variant of `embed_texts` that does not block the event loop."""
+    if not texts:
+        return []
+    inputs = _prepare_inputs(texts)
+    if not inputs:
+        return []
+
+    logger.info(f"Embedding {len(inputs)} texts with model {model}")
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            url, headers, payload = _build_request(inputs, model)
+            resp = await _async_client.post(url, json=payload, headers=headers)
+            if resp.status_code in _FALLBACK_STATUS:
+                logger.warning(f"Batch endpoint {url} returned {resp.status_code}; falling back to {OLLAMA_LEGACY_EMBED_PATH}")
+                return await _aembed_legacy(inputs, model, retries, backoff)
+            vectors = _vectors_from_response(resp, inputs)
+            break
+        except Exception as e:
+            logger.warning(f"Batch embedding attempt {attempt} failed for {len(inputs)} texts: {e}")
+            if attempt >= retries:
+                logger.error(f"Batch embedding failed after {retries} retries")
+                raise
+            await asyncio.sleep(backoff * (2 ** (attempt - 1)))
+
+    # one (N, D) float32 allocation for the whole batch; rows are views into it
+    embeddings = list(np.asarray(vectors, dtype=np.float32))
     logger.info(f"Successfully embedded {len(embeddings)} texts")
-    return embeddings
\ No newline at end of file
+    return embeddings
+
+async def aclose_clients():
+    """Close the pooled HTTP clients (call on application shutdown)."""
+    await _async_client.aclose()
+    _client.close()
@@ -2,12 +2,15 @@
 import asyncio
 import os
 import time
+import queue
 import threading
 import numpy as np
-from typing import Any, Dict, List, Tuple
-from app.embeddings.cache import Cache, compute_hash
-from app.embeddings.ollama_embeddings import embed_texts
-from app.vector_store.chroma_client import get_chroma_client, ingest_batch
+from typing import Any, Dict, List, Optional, Tuple
+from app.embeddings.cache import Cache, compute_hashes
+from app.embeddings.batcher import BatchedEmbedder
+from app.embeddings._kernels import l2_normalize
+from app.vector_store.chroma_client import get_chroma_client, filter_changed, ingest_batch
+from app.retrieval.bm25_retriever import enqueue_bm25_update
 import logging
 
 logger = logging.getLogger(__name__)  
@@ -15,15 +18,35 @@ logger = logging.getLogger(__name__)
 EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "3"))
 EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
 EMBED_BATCH_WAIT_MS = int(os.getenv("EMBED_BATCH_WAIT_MS", "200"))
+# Max texts per Ollama request (adaptive below this); larger worker batches fan out into concurrent requests
+EMBED_SHARD_SIZE = int(os.getenv("EMBED_SHARD_SIZE", "16"))
+# How long the shared embedder waits to coalesce texts from different workers
+EMBED_COALESCE_WAIT_MS = int(os.getenv("EMBED_COALESCE_WAIT_MS", "50"))
+# Last batch size that worked, so adaptive sizing survives restarts
+EMBED_BATCH_STATE_PATH = os.getenv("EMBED_BATCH_STATE_PATH", "embed_batch_state.json")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "bge-m3")
 EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "embeddings_cache.sqlite3")
+# Store newly cached vectors as int8 + per-row scale (4x smaller) when set to 1
+EMBED_CACHE_QUANTIZE = os.getenv("EMBED_CACHE_QUANTIZE", "0") == "1"
 CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "documents")
 
-_cache = Cache(EMBED_CACHE_PATH)
+_cache = Cache(EMBED_CACHE_PATH, quantize=EMBED_CACHE_QUANTIZE)
 _queue: "asyncio.Queue[Tuple[str,str,Dict[str,Any]]]" = asyncio.Queue()
 _worker_tasks: List[asyncio.Task] = []
+_chroma_client = None  # shared by all workers, created once in _start_all_workers
+_embedder = BatchedEmbedder(
+    EMBED_MODEL,
+    max_batch=EMBED_SHARD_SIZE,
+    wait_ms=EMBED_COALESCE_WAIT_MS,
+    state_path=EMBED_BATCH_STATE_PATH,
+)
 _started = False
 _started_lock = threading.Lock()  # Thread-safe flag access
+# Sync callers (chunkers, possibly in other threads) hand items to the loop that
+# owns `_queue`; items enqueued before the workers start wait in `_bridge_q`.
+_main_loop: Optional[asyncio.AbstractEventLoop] = None
+_bridge_q: "queue.SimpleQueue[Tuple[str,str,Dict[str,Any]]]" = queue.SimpleQueue()
+_bridge_lock = threading.Lock()
 
 async def _gather_batch(initial_item, max_size: int, wait_ms: int):
     batch = [initial_item]
@@ -41,8 +64,7 @@ async def _gather_batch(initial_item, max_size: int, wait_ms: int):
             break
     return batch
 
-async def _worker_loop(worker_index: int):
-    chroma_client = get_chroma_client()  # initialize per worker (lightweight)
+async def _worker_loop(worker_index: int, chroma_client):
     logger.info(f"Worker {worker_index} started")
     while True:
         item = await _queue.get()
@@ -57,36 +79,57 @@ async def _worker_loop(worker_index: int):
             metas = [it[2] or {} for it in batch]
             logger.info(f"Worker {worker_index} processing batch of {len(batch)} chunks")
 
-            hashes = [compute_hash(t, EMBED_MODEL) for t in texts]
-            cached = _cache.bulk_get(hashes)
+            # chunks already stored with identical text and metadata need no embedding or write
+            changed = await asyncio.to_thread(filter_changed, chroma_client, CHROMA_COLLECTION, ids, texts, metas)
+            if len(changed) < len(ids):
+                logger.info(f"Worker {worker_index} skipping {len(ids) - len(changed)} unchanged chunks")
+                if not changed:
+                    continue
+                ids = [ids[i] for i in changed]
+                texts = [texts[i] for i in changed]
+                metas = [metas[i] for i in changed]
 
-            embeddings: List[np.ndarray] = [None] * len(batch)
-            missing_indices = []
-            missing_texts = []
+            # hashing and the SQLite lookup are CPU/IO bound; run them off the event loop
+            hashes = await asyncio.to_thread(compute_hashes, texts, EMBED_MODEL)
+            cached = await asyncio.to_thread(_cache.bulk_get, hashes)
+
+            embeddings: List[np.ndarray] = [None] * len(ids)
+            # group uncached positions by hash so duplicate texts are embedded once
+            missing: Dict[str, List[int]] = {}
 
             for i, h in enumerate(hashes):
                 if h in cached:
                     embeddings[i] = cached[h]
                 else:
-                    missing_indices.append(i)
-                    missing_texts.append(texts[i])
-
-            if missing_texts:
-                new_vectors = embed_texts(missing_texts, model=EMBED_MODEL)
-                # place vectors into embeddings by mapping
-                for idx, vec in zip(missing_indices, new_vectors):
-                    embeddings[idx] = vec
-                # bulk_set into cache
+                    missing.setdefault(h, []).append(i)
+
+            if missing:
+                unique_hashes = list(missing)
+                new_vectors = await _embedder.embed_many([texts[missing[h][0]] for h in unique_hashes])
+                # normalize before caching: unit rows are what the int8 cache's symmetric
+                # per-row scale is sized for, and what ingestion needs anyway
+                new_matrix = l2_normalize(np.ascontiguousarray(np.stack(new_vectors), dtype=np.float32))
+                # scatter each vector back to every position sharing its hash
                 cache_items = []
-                for i in missing_indices:
-                    cache_items.append((hashes[i], EMBED_MODEL, texts[i], embeddings[i]))
-                _cache.bulk_set(cache_items)
-                logger.info(f"Worker {worker_index} cached {len(missing_texts)} new embeddings")
+                for h, vec in zip(unique_hashes, new_matrix):
+                    for i in missing[h]:
+                        embeddings[i] = vec
+                    cache_items.append((h, EMBED_MODEL, texts[missing[h][0]], vec))
+                await asyncio.to_thread(_cache.bulk_set, cache_items)
+                logger.info(f"Worker {worker_index} cached {len(unique_hashes)} new embeddings")
 
             # Now store to vector store (Chroma)
-            # ingest_batch should accept lists: ids, texts, metas, embeddings (numpy arrays)
-            ingest_batch(chroma_client, CHROMA_COLLECTION, ids, texts, metas, [e.tolist() if isinstance(e, np.ndarray) else e for e in embeddings])
+            # ingest_batch accepts lists of ids, texts, metas plus the embedding matrix
+            # pass one contiguous (N, D) float32 matrix instead of lists of Python floats
+            emb_matrix = np.ascontiguousarray(np.stack(embeddings), dtype=np.float32)
+            # unit-length rows: cosine and L2 rankings agree regardless of the collection's space
+            # (new rows already are; this covers entries cached before normalization moved up)
+            l2_normalize(emb_matrix)
+            ingest_batch(chroma_client, CHROMA_COLLECTION, ids, texts, metas, emb_matrix)
             logger.info(f"Worker {worker_index} ingested {len(ids)} chunks to Chroma")
+            # keep the keyword index in step with the vector store
+            for id_, text, meta in zip(ids, texts, metas):
+                enqueue_bm25_update(id_, text, meta)
         except Exception as e:
             logger.error(f"Embedding worker error: {e}")
         finally:
@@ -94,10 +137,12 @@ async def _worker_loop(worker_index: int):
                 _queue.task_done()
 
 async def _start_all_workers():
-    global _worker_tasks
+    global _worker_tasks, _chroma_client
     _worker_tasks = []
+    if _chroma_client is None:
+        _chroma_client = get_chroma_client()
     for i in range(EMBED_WORKERS):
-        t = asyncio.create_task(_worker_loop(i))
+        t = asyncio.create_task(_worker_loop(i, _chroma_client))
         _worker_tasks.append(t)
 
 async def _stop_all_workers():
@@ -114,6 +159,7 @@ def start_workers(loop: asyncio.AbstractEventLoop = None):
             return
         _started = True
     loop = loop or asyncio.get_event_loop()
+    _bind_loop(loop)
     loop.create_task(_start_all_workers())
 
 async def stop_workers():
@@ -124,25 +170,65 @@ async def stop_workers():
         _started = False
     await _stop_all_workers()
 
-# sync helper for chunker (works both from async context and sync code)
+def _bind_loop(loop: asyncio.AbstractEventLoop):
+    """Record the loop that owns `_queue` and flush anything buffered before it existed."""
+    global _main_loop
+    with _bridge_lock:
+        _main_loop = loop
+        while True:
+            try:
+                item = _bridge_q.get_nowait()
+            except queue.Empty:
+                break
+            loop.call_soon_threadsafe(_queue.put_nowait, item)
+
+# sync helper for chunker (works both from async context and sync code, any thread)
 def enqueue_chunk_sync(chunk_id: str, text: str, metadata: Dict[str, Any] = None):
     metadata = metadata or {}
     logger.info(f"Enqueuing chunk {chunk_id} for embedding (text length: {len(text)})")
-    try:
-        loop = asyncio.get_running_loop()
-    except RuntimeError:
-        loop = None
     item = (chunk_id, text, metadata)
-    if loop and loop.is_running():
-        loop.call_soon_threadsafe(_queue.put_nowait, item)
-    else:
-        # background thread that pumps into the running event loop if any
-        def _put():
-            import asyncio
-            new_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(new_loop)
-            new_loop.run_until_complete(_queue.put(item))
-            new_loop.close()
-        import threading
-        t = threading.Thread(target=_put, daemon=True)
-        t.start()
\ No newline at end of file
+    loop = _main_loop
+    if loop is None:
+        with _bridge_lock:
+            loop = _main_loop
+            if loop is None:
+                # workers not started yet: buffer until start_workers binds the loop
+                _bridge_q.put(item)
+                return
+    loop.call_soon_threadsafe(_queue.put_nowait, item)
+
+
+def _put_many(items: List[Tuple[str, str, Dict[str, Any]]]):
+    for item in items:
+        _queue.put_nowait(item)
+
+
+def enqueue_chunks_sync(items: List[Tuple[str, str, Dict[str, Any]]]):
+    """Enqueue many (chunk_id, text, metadata) items with one hand-off to the loop.
+
+    Same semantics as calling `enqueue_chunk_sync` per item, but wakes the
+    event loop once for the whole batch instead of once per chunk.
+    """
+    items = [(cid, text, meta or {}) for cid, text, meta in items]
+    if not items:
+        return
+    logger.info(f"Enqueuing {len(items)} chunks for embedding")
+    loop = _main_loop
+    if loop is None:
+        with _bridge_lock:
+            loop = _main_loop
+            if loop is None:
+                for item in items:
+                    _bridge_q.put(item)
+                return
+    loop.call_soon_threadsafe(_put_many, items)
+
+
+async def get_cached_answer(key: str) -> Optional[str]:
+    """Answer cached under `key` (see `compute_answer_key`), or None; the SQLite read runs off the loop."""
+    return await asyncio.to_thread(_cache.get_answer, key)
+
+
+async def cache_answer(key: str, answer: str):
+    """Cache `answer` under `key`; the SQLite write runs off the loop."""
+    await asyncio.to_thread(_cache.set_answer, key, answer)
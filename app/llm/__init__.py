@@ -1,4 +1,4 @@
 # app/llm/__init__.py
-from .ollama_llm import generate_answer
+from .ollama_llm import generate_answer, stream_answer, is_ollama_available, aclose_client
 
-__all__ = ["generate_answer"]
+__all__ = ["generate_answer", "stream_answer", "is_ollama_available", "aclose_client"]
@@ -1,8 +1,11 @@
 # app/llm/ollama_llm.py
 import os
-import requests
+import importlib.util
+import asyncio
+import httpx
+import orjson
 import logging
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, List, Dict, Any, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -11,28 +14,30 @@ DEFAULT_MODEL = os.getenv("LLM_MODEL", "llama3")
 DEFAULT_TIMEOUT = float(os.getenv("OLLAMA_LLM_TIMEOUT", "180"))
 MAX_RETRIES = int(os.getenv("OLLAMA_LLM_RETRIES", "3"))
 RETRY_BACKOFF = float(os.getenv("OLLAMA_LLM_BACKOFF", "1.5"))
+# HTTP/2 is only negotiated over TLS and needs the optional h2 package; opt-in
+OLLAMA_HTTP2 = os.getenv("OLLAMA_HTTP2", "0") == "1"
+if OLLAMA_HTTP2 and importlib.util.find_spec("h2") is None:
+    logger.warning("OLLAMA_HTTP2=1 but the h2 package is not installed; using HTTP/1.1")
+    OLLAMA_HTTP2 = False
+NO_CONTEXT_ANSWER = "I don't have enough context to answer this question."
+_GENERATE_URL = f"{OLLAMA_URL.rstrip('/')}/api/generate"
 
+# Shared pooled client so LLM calls reuse keep-alive connections
+_client = httpx.AsyncClient(
+    http2=OLLAMA_HTTP2,
+    timeout=DEFAULT_TIMEOUT,
+    limits=httpx.Limits(max_keepalive_connections=40, max_connections=100, keepalive_expiry=30.0),
+)
 
-def generate_answer(
+
+def _build_payload(
     question: str,
     context_chunks: List[Dict[str, Any]],
-    model: str = DEFAULT_MODEL,
-    system_prompt: Optional[str] = None,
-) -> str:
-    """Generate an answer using Ollama LLM with retrieved context chunks.
-    
-    Args:
-        question: User's question
-        context_chunks: List of dicts with 'text' and optional 'metadata'
-        model: Ollama model name (default: llama3)
-        system_prompt: Optional system prompt override
-        
-    Returns:
-        Generated answer string
-    """
-    if not context_chunks:
-        return "I don't have enough context to answer this question."
-    
+    model: str,
+    system_prompt: Optional[str],
+    stream: bool,
+) -> Dict[str, Any]:
+    """Build the /api/generate payload from the question and context chunks."""
     # Build context from chunks
     context_parts = []
     for idx, chunk in enumerate(context_chunks, start=1):
@@ -62,22 +67,45 @@ Question: {question}
 
 Answer:"""
     
-    # Call Ollama API with simple retries for robustness
-    url = f"{OLLAMA_URL.rstrip('/')}/api/generate"
-    payload = {
+    return {
         "model": model,
         "prompt": user_prompt,
         "system": system_prompt,
-        "stream": False,
+        "stream": stream,
     }
 
+
+async def generate_answer(
+    question: str,
+    context_chunks: List[Dict[str, Any]],
+    model: str = DEFAULT_MODEL,
+    system_prompt: Optional[str] = None,
+) -> str:
+    """Generate an answer using Ollama LLM with retrieved context chunks.
+    
+    Args:
+        question: User's question
+        context_chunks: List of dicts with 'text' and optional 'metadata'
+        model: Ollama model name (default: llama3)
+        system_prompt: Optional system prompt override
+        
+    Returns:
+        Generated answer string
+    """
+    if not context_chunks:
+        return NO_CONTEXT_ANSWER
+    
+    # Call Ollama API with simple retries for robustness
+    url = _GENERATE_URL
+    payload = _build_payload(question, context_chunks, model, system_prompt, stream=False)
+
     last_err = None
     for attempt in range(1, MAX_RETRIES + 2):
         try:
             logger.info(f"Generating answer with {model} (attempt {attempt}) for question: {question[:50]}...")
-            response = requests.post(url, json=payload, timeout=DEFAULT_TIMEOUT)
+            response = await _client.post(url, json=payload)
             response.raise_for_status()
-            result = response.json()
+            result = orjson.loads(response.content)
             answer = result.get("response", "").strip()
             logger.info(f"Generated answer ({len(answer)} chars)")
             return answer
@@ -85,9 +113,67 @@ Answer:"""
             last_err = e
             logger.warning(f"LLM generation attempt {attempt} failed: {e}")
             if attempt <= MAX_RETRIES:
-                import time
-                time.sleep(RETRY_BACKOFF ** attempt)
+                await asyncio.sleep(RETRY_BACKOFF ** attempt)
             else:
                 break
     logger.error(f"LLM generation failed after retries: {last_err}")
-    raise last_err
\ No newline at end of file
+    raise last_err
+
+
+async def stream_answer(
+    question: str,
+    context_chunks: List[Dict[str, Any]],
+    model: str = DEFAULT_MODEL,
+    system_prompt: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """Stream an answer token-by-token from Ollama as it is generated.
+
+    Retries are only attempted before the first token is yielded; once output
+    has started, errors propagate to the caller.
+    """
+    if not context_chunks:
+        yield NO_CONTEXT_ANSWER
+        return
+
+    url = _GENERATE_URL
+    payload = _build_payload(question, context_chunks, model, system_prompt, stream=True)
+
+    for attempt in range(1, MAX_RETRIES + 2):
+        started = False
+        try:
+            logger.info(f"Streaming answer with {model} (attempt {attempt}) for question: {question[:50]}...")
+            async with _client.stream("POST", url, json=payload) as response:
+                response.raise_for_status()
+                # Ollama streams one JSON object per line until "done": true
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    data = orjson.loads(line)
+                    token = data.get("response", "")
+                    if token:
+                        started = True
+                        yield token
+                    if data.get("done"):
+                        break
+            return
+        except Exception as e:
+            logger.warning(f"LLM streaming attempt {attempt} failed: {e}")
+            if started or attempt > MAX_RETRIES:
+                logger.error(f"LLM streaming failed: {e}")
+                raise
+            await asyncio.sleep(RETRY_BACKOFF ** attempt)
+
+
+async def is_ollama_available(base_url: str = OLLAMA_URL, timeout: float = 2.0) -> bool:
+    """Probe Ollama's /api/tags over the pooled client; True if it answers 200 within `timeout`."""
+    try:
+        resp = await _client.head(f"{base_url.rstrip('/')}/api/tags", timeout=timeout)
+        return resp.status_code == 200
+    except Exception as e:
+        logger.debug(f"Ollama health check failed: {e}")
+        return False
+
+
+async def aclose_client():
+    """Close the pooled HTTP client (call on application shutdown)."""
+    await _client.aclose()
@@ -1,16 +1,20 @@
 # app/main.py
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from app.routers import upload
 from app.embeddings import worker
 from pydantic import BaseModel
 from typing import List, Optional
+import asyncio
+import json
 import logging
 import os
-import requests
-from app.vector_store.chroma_client import get_chroma_client
 from app.retrieval.hybrid_retriever import HybridRetriever
 from app.retrieval.bm25_retriever import start_bm25_rebuild_task
-from app.llm import generate_answer
+from app.llm import generate_answer, stream_answer, is_ollama_available, aclose_client as aclose_llm_client
+from app.llm.ollama_llm import DEFAULT_MODEL as LLM_MODEL
+from app.embeddings.cache import compute_answer_key
+from app.embeddings.ollama_embeddings import aclose_clients as aclose_embed_clients
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -18,6 +22,8 @@ logger = logging.getLogger(__name__)
 CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "documents")
 
 app = FastAPI()
+# Created once at startup and shared by all requests
+_hybrid_retriever: Optional[HybridRetriever] = None
 app.include_router(upload.router)
 
 # Health check models
@@ -32,6 +38,8 @@ class QueryRequest(BaseModel):
     use_llm: bool = True
     where: Optional[dict] = None
     where_document: Optional[dict] = None
+    no_cache: bool = False  # bypass the answer cache and always call the LLM
+    stream: bool = False  # stream NDJSON: results first, then answer tokens as generated
 
 class QueryResult(BaseModel):
     id: str
@@ -45,16 +53,21 @@ class AskResponse(BaseModel):
     top_k: int
     results: List[QueryResult]
 
+class BatchSearchRequest(BaseModel):
+    questions: List[str]
+    top_k: int = 10
+    where: Optional[dict] = None
+    where_document: Optional[dict] = None
+
+class BatchSearchResponse(BaseModel):
+    results: List[AskResponse]
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Basic health check endpoint"""
     ollama_url = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
-    try:
-        response = requests.head(f"{ollama_url}/api/tags", timeout=2)
-        ollama_available = response.status_code == 200
-    except Exception as e:
-        logger.debug(f"Ollama health check failed: {e}")
-        ollama_available = False
+    # shared pooled LLM client, with a short timeout for this probe only
+    ollama_available = await is_ollama_available(ollama_url, timeout=2)
     
     return HealthResponse(
         status="healthy",
@@ -68,11 +81,12 @@ async def ask(req: QueryRequest):
         raise HTTPException(status_code=400, detail="Question must not be empty")
 
     # Use production-grade hybrid retrieval (BM25 + vector + optional reranker)
+    if _hybrid_retriever is None:
+        raise HTTPException(status_code=503, detail="Retriever not initialized")
     try:
-        global _hybrid_retriever
-        if '_hybrid_retriever' not in globals() or _hybrid_retriever is None:
-            _hybrid_retriever = HybridRetriever(collection_name=CHROMA_COLLECTION)
-        hybrid_docs = _hybrid_retriever.retrieve(
+        # retrieval embeds the query and runs the reranker synchronously; keep it off the event loop
+        hybrid_docs = await asyncio.to_thread(
+            _hybrid_retriever.retrieve,
             query=req.question.strip(),
             top_k=max(1, req.top_k),
             where=req.where,
@@ -82,6 +96,58 @@ async def ask(req: QueryRequest):
         logger.error(f"Hybrid retrieval failed: {e}")
         raise HTTPException(status_code=500, detail=f"Retrieval failed: {e}")
 
+    results = _to_query_results(hybrid_docs)
+
+    if req.stream:
+        return StreamingResponse(_stream_ask(req, results), media_type="application/x-ndjson")
+
+    # Generate LLM answer if requested
+    answer = None
+    if req.use_llm and results:
+        question = req.question.strip()
+        cache_key = compute_answer_key(question, [r.text for r in results], LLM_MODEL)
+        if not req.no_cache:
+            answer = await worker.get_cached_answer(cache_key)
+            if answer is not None:
+                logger.info("Answer cache hit")
+        if answer is None:
+            try:
+                answer = await generate_answer(question, _context_chunks(results))
+            except Exception as e:
+                logger.error(f"LLM answer generation failed: {e}")
+                answer = f"Error generating answer: {str(e)}"
+            else:
+                await _cache_answer(cache_key, answer)
+
+    return AskResponse(question=req.question, answer=answer, top_k=len(results), results=results)
+
+@app.post("/search/batch", response_model=BatchSearchResponse)
+async def search_batch(req: BatchSearchRequest):
+    """Retrieve for several questions at once; candidates of all questions are reranked in one batch."""
+    questions = [q.strip() for q in req.questions]
+    if not questions or not all(questions):
+        raise HTTPException(status_code=400, detail="Questions must not be empty")
+    if _hybrid_retriever is None:
+        raise HTTPException(status_code=503, detail="Retriever not initialized")
+    try:
+        batches = await asyncio.to_thread(
+            _hybrid_retriever.retrieve_many,
+            questions,
+            top_k=max(1, req.top_k),
+            where=req.where,
+            where_document=req.where_document,
+        )
+    except Exception as e:
+        logger.error(f"Batch retrieval failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Retrieval failed: {e}")
+
+    responses = []
+    for question, docs in zip(req.questions, batches):
+        results = _to_query_results(docs)
+        responses.append(AskResponse(question=question, top_k=len(results), results=results))
+    return BatchSearchResponse(results=responses)
+
+def _to_query_results(hybrid_docs: List[dict]) -> List[QueryResult]:
     # Map hybrid results to QueryResult
     results: List[QueryResult] = []
     for doc in hybrid_docs:
@@ -93,33 +159,75 @@ async def ask(req: QueryRequest):
                 distance=float(doc.get('hybrid_score', 0.0)),
             )
         )
+    return results
 
-    # Generate LLM answer if requested
-    answer = None
-    if req.use_llm and results:
-        try:
-            context_chunks = [{"text": r.text, "metadata": r.metadata} for r in results]
-            answer = generate_answer(req.question.strip(), context_chunks)
-        except Exception as e:
-            logger.error(f"LLM answer generation failed: {e}")
-            answer = f"Error generating answer: {str(e)}"
+def _context_chunks(results: List[QueryResult]) -> List[dict]:
+    return [{"text": r.text, "metadata": r.metadata} for r in results]
 
-    return AskResponse(question=req.question, answer=answer, top_k=len(results), results=results)
+async def _cache_answer(cache_key: str, answer: str):
+    """Cache a generated answer; a failed write is logged, never surfaced to the caller."""
+    try:
+        await worker.cache_answer(cache_key, answer)
+    except Exception as e:
+        logger.warning(f"Failed to cache answer: {e}")
+
+async def _stream_ask(req: QueryRequest, results: List[QueryResult]):
+    """Yield NDJSON lines: one with the retrieved results, then one per answer token."""
+    yield json.dumps({
+        "question": req.question,
+        "top_k": len(results),
+        "results": [r.model_dump() for r in results],
+    }) + "\n"
+    if not (req.use_llm and results):
+        return
+
+    question = req.question.strip()
+    cache_key = compute_answer_key(question, [r.text for r in results], LLM_MODEL)
+    cached = None if req.no_cache else await worker.get_cached_answer(cache_key)
+    if cached is not None:
+        logger.info("Answer cache hit")
+        yield json.dumps({"token": cached}) + "\n"
+        return
+
+    parts: List[str] = []
+    try:
+        async for token in stream_answer(question, _context_chunks(results)):
+            parts.append(token)
+            yield json.dumps({"token": token}) + "\n"
+    except Exception as e:
+        logger.error(f"LLM answer streaming failed: {e}")
+        yield json.dumps({"error": f"Error generating answer: {str(e)}"}) + "\n"
+        return
+    answer = "".join(parts).strip()
+    # a stream that produced no tokens is not an answer worth serving again
+    if answer:
+        await _cache_answer(cache_key, answer)
 
 @app.on_event("startup")
 async def startup_event():
     worker.start_workers()
-    # Initialize hybrid retriever and start BM25 periodic rebuild task
+    # Initialize hybrid retriever and start the BM25 update task
     global _hybrid_retriever
     _hybrid_retriever = HybridRetriever(collection_name=CHROMA_COLLECTION)
     logger.info("HybridRetriever initialized")
-    # Start BM25 rebuild background task
-    import asyncio
-    client = get_chroma_client()
-    asyncio.create_task(start_bm25_rebuild_task(chroma_client=client, collection_name=CHROMA_COLLECTION))
+    if _hybrid_retriever.reranker is not None:
+        # load the cross-encoder in the background so the first query doesn't pay for it
+        asyncio.create_task(asyncio.to_thread(_hybrid_retriever.reranker.warmup))
+    # The task folds chunks ingested by the workers into the retriever's own index
+    # so queries see new documents without a second in-memory copy
+    asyncio.create_task(start_bm25_rebuild_task(
+        chroma_client=_hybrid_retriever.chroma_client,
+        collection_name=CHROMA_COLLECTION,
+        bm25_retriever=_hybrid_retriever.bm25,
+    ))
     logger.info("Application startup complete")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     await worker.stop_workers()
+    if _hybrid_retriever is not None:
+        # BM25 updates are saved on an interval; write out the last ones
+        await asyncio.to_thread(_hybrid_retriever.bm25.save_if_dirty)
+    await aclose_llm_client()
+    await aclose_embed_clients()
     logger.info("Application shutdown complete")
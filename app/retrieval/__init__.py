@@ -1,5 +1,5 @@
 # app/retrieval/__init__.py
 from .hybrid_retriever import HybridRetriever
-from .reranker import Reranker
+from .reranker import Reranker, get_reranker
 
-__all__ = ["HybridRetriever", "Reranker"]
+__all__ = ["HybridRetriever", "Reranker", "get_reranker"]
@@ -1,16 +1,154 @@
 # app/retrieval/bm25_retriever.py
 import os
+import re
 import logging
 import asyncio
-from typing import List, Dict, Any, Optional
-from rank_bm25 import BM25Okapi
-import pickle
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Optional, Set
+import numpy as np
+import msgpack
+from scipy import sparse
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
 BM25_CACHE_DIR = os.getenv("BM25_CACHE_DIR", "bm25_index")
-BM25_REBUILD_INTERVAL = int(os.getenv("BM25_REBUILD_INTERVAL", "300"))
+# Max documents folded into the index per update batch
+BM25_UPDATE_BATCH = int(os.getenv("BM25_UPDATE_BATCH", "256"))
+# Seconds between index saves while updates are coming in (and at shutdown)
+BM25_SAVE_INTERVAL = float(os.getenv("BM25_SAVE_INTERVAL", "30"))
+# Rebuild from Chroma once postings have grown by this fraction since the last full build
+BM25_REBUILD_GROWTH = float(os.getenv("BM25_REBUILD_GROWTH", "0.5"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+# Word characters (letters, digits, underscore; Unicode-aware), so punctuation never sticks to terms
+_TOKEN_RE = re.compile(r"\w+")
+# Bump when tokenization or the on-disk layout changes; older indexes are rebuilt
+_INDEX_FORMAT = 2
+
+# Documents ingested into Chroma, waiting to be added to the BM25 index
+bm25_update_queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+
+
+def _tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class SparseBM25:
+    """BM25 with term scores precomputed at index time.
+
+    Each stored value is the full contribution of term t to document d,
+    idf(t) * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)), in a
+    (terms x documents) CSR matrix, so scoring a query is a sum of the rows
+    of its terms instead of a Python loop over the corpus.
+
+    Raw term frequencies are kept next to the weights so single documents can
+    be added or replaced without re-tokenizing the corpus: `set_document` only
+    records that document's term counts, and df/idf and the weights are
+    recomputed in bulk (vectorized) by the next `refresh`.
+    """
+
+    def __init__(self, corpus: List[List[str]], k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        term_ids: List[int] = []
+        doc_ids: List[int] = []
+        tfs: List[int] = []
+        for d, tokens in enumerate(corpus):
+            for tok, tf in Counter(tokens).items():
+                term_ids.append(self.vocab.setdefault(tok, len(self.vocab)))
+                doc_ids.append(d)
+                tfs.append(tf)
+        self.tf = sparse.csc_matrix(
+            (np.asarray(tfs, dtype=np.float32), (np.asarray(term_ids, dtype=np.int32), np.asarray(doc_ids, dtype=np.int32))),
+            shape=(len(self.vocab), len(corpus)),
+            dtype=np.float32,
+        )
+        self.n_docs = len(corpus)
+        # doc index -> ({term id: tf}, doc length), applied by refresh()
+        self._pending: Dict[int, Any] = {}
+        self._reweigh()
+
+    @classmethod
+    def from_parts(
+        cls, tf: sparse.spmatrix, vocab: Dict[str, int], k1: float, b: float
+    ) -> "SparseBM25":
+        """Rebuild an index from its persisted term frequencies without re-tokenizing the corpus."""
+        self = cls.__new__(cls)
+        self.k1 = k1
+        self.b = b
+        self.vocab = vocab
+        self.tf = tf.tocsc().astype(np.float32)
+        self.n_docs = self.tf.shape[1]
+        self._pending = {}
+        self._reweigh()
+        return self
+
+    def _reweigh(self):
+        """Recompute idf, document lengths and the weighted matrix from `self.tf`."""
+        k1, b = self.k1, self.b
+        n_terms, n_docs = self.tf.shape
+        coo = self.tf.tocoo()
+        t, d, tf = coo.row, coo.col, coo.data
+        doc_len = np.bincount(d, weights=tf, minlength=n_docs).astype(np.float32)
+        df = np.bincount(t, minlength=n_terms).astype(np.float32)
+        # Lucene-style idf, always positive
+        self.idf = np.log((n_docs - df + 0.5) / (df + 0.5) + 1.0).astype(np.float32)
+        avgdl = float(doc_len.mean()) if n_docs and doc_len.mean() > 0 else 1.0
+        norm = k1 * (1.0 - b + b * doc_len / avgdl)
+        vals = self.idf[t] * tf * (k1 + 1.0) / (tf + norm[d])
+        self.matrix = sparse.csr_matrix((vals, (t, d)), shape=(n_terms, n_docs), dtype=np.float32)
+
+    def set_document(self, doc_index: int, tokens: List[str]):
+        """Replace document `doc_index`, or append it when it equals `n_docs`.
+
+        O(len(tokens)); the matrix is updated by the next `refresh`.
+        """
+        if doc_index > self.n_docs:
+            raise IndexError(f"document index {doc_index} out of range for {self.n_docs} documents")
+        counts = {self.vocab.setdefault(tok, len(self.vocab)): tf for tok, tf in Counter(tokens).items()}
+        self._pending[doc_index] = (counts, len(tokens))
+        if doc_index == self.n_docs:
+            self.n_docs += 1
+
+    def refresh(self):
+        """Fold pending document changes into the matrices (no-op when clean)."""
+        if not self._pending:
+            return
+        coo = self.tf.tocoo()
+        replaced = np.zeros(self.n_docs, dtype=bool)
+        replaced[np.fromiter(self._pending, dtype=np.int64, count=len(self._pending))] = True
+        keep = ~replaced[coo.col]
+        new_t: List[int] = []
+        new_d: List[int] = []
+        new_tf: List[int] = []
+        for d, (counts, _) in self._pending.items():
+            new_t.extend(counts)
+            new_d.extend([d] * len(counts))
+            new_tf.extend(counts.values())
+        t = np.concatenate([coo.row[keep], np.asarray(new_t, dtype=np.int32)])
+        d = np.concatenate([coo.col[keep], np.asarray(new_d, dtype=np.int32)])
+        tf = np.concatenate([coo.data[keep], np.asarray(new_tf, dtype=np.float32)])
+        self.tf = sparse.csc_matrix((tf, (t, d)), shape=(len(self.vocab), self.n_docs), dtype=np.float32)
+        self._pending = {}
+        self._reweigh()
+
+    @property
+    def n_postings(self) -> int:
+        """(term, document) pairs, including changes not yet folded in by `refresh`."""
+        return self.tf.nnz + sum(len(counts) for counts, _ in self._pending.values())
+
+    def get_scores(self, tokens: List[str]) -> np.ndarray:
+        """Return a score per document (repeated query terms count repeatedly)."""
+        matrix = self.matrix
+        # terms added since the last refresh have no row yet
+        ids = [i for i in (self.vocab.get(tok) for tok in tokens) if i is not None and i < matrix.shape[0]]
+        if not ids:
+            return np.zeros(matrix.shape[1], dtype=np.float32)
+        return np.asarray(matrix[ids].sum(axis=0)).ravel()
 
 
 
@@ -21,37 +159,102 @@ class BM25Retriever:
         self.collection_name = collection_name
         self.cache_dir = Path(BM25_CACHE_DIR)
         self.cache_dir.mkdir(parents=True, exist_ok=True)
-        self.index_path = self.cache_dir / f"{collection_name}_bm25.pkl"
-        self.docs_path = self.cache_dir / f"{collection_name}_docs.pkl"
+        # term-frequency matrix as .npz; vocab and the documents as msgpack (no pickle graphs)
+        self.matrix_path = self.cache_dir / f"{collection_name}_bm25.npz"
+        self.index_path = self.cache_dir / f"{collection_name}_bm25.msgpack"
+        self.docs_path = self.cache_dir / f"{collection_name}_docs.msgpack"
         
-        self.bm25: Optional[BM25Okapi] = None
+        self.bm25: Optional[SparseBM25] = None
         self.documents: List[Dict[str, Any]] = []
+        # doc id -> position in `documents` (and column in the BM25 matrix)
+        self._positions: Dict[str, int] = {}
+        # guards (bm25, documents) together; searches may run in worker threads
+        self._lock = threading.Lock()
+        # updates not yet written to disk (see save_if_dirty)
+        self.dirty = False
+        # postings at the last full build or load; growth past it triggers a rebuild
+        self._postings_at_build = 0
         self._load_index()
     
     def _load_index(self):
         """Load BM25 index from cache if available."""
-        if self.index_path.exists() and self.docs_path.exists():
+        if self.matrix_path.exists() and self.index_path.exists() and self.docs_path.exists():
             try:
+                tf = sparse.load_npz(self.matrix_path)
                 with open(self.index_path, "rb") as f:
-                    self.bm25 = pickle.load(f)
+                    meta = msgpack.unpackb(f.read(), raw=False)
+                if meta.get("format") != _INDEX_FORMAT:
+                    raise ValueError(f"index format {meta.get('format')} != {_INDEX_FORMAT}; will rebuild")
                 with open(self.docs_path, "rb") as f:
-                    self.documents = pickle.load(f)
+                    docs = msgpack.unpackb(f.read(), raw=False)
+                self.bm25 = SparseBM25.from_parts(tf, meta["vocab"], meta["k1"], meta["b"])
+                self.documents = [
+                    {"id": id_, "text": text, "metadata": metadata}
+                    for id_, text, metadata in zip(docs["ids"], docs["texts"], docs["metadatas"])
+                ]
+                self._positions = {doc["id"]: i for i, doc in enumerate(self.documents)}
+                self._postings_at_build = self.bm25.n_postings
                 logger.info(f"Loaded BM25 index with {len(self.documents)} documents")
             except Exception as e:
                 logger.warning(f"Failed to load BM25 index: {e}")
                 self.bm25 = None
                 self.documents = []
+                self._positions = {}
     
     def _save_index(self):
         """Save BM25 index to cache."""
+        with self._lock:
+            bm25, documents = self.bm25, list(self.documents)
+            bm25.refresh()
+            tf, vocab = bm25.tf, dict(bm25.vocab)
+            # later updates set it again and are picked up by the next save
+            self.dirty = False
         try:
+            sparse.save_npz(self.matrix_path, tf)
             with open(self.index_path, "wb") as f:
-                pickle.dump(self.bm25, f)
+                f.write(msgpack.packb(
+                    {"format": _INDEX_FORMAT, "vocab": vocab, "k1": bm25.k1, "b": bm25.b},
+                    use_bin_type=True,
+                ))
             with open(self.docs_path, "wb") as f:
-                pickle.dump(self.documents, f)
-            logger.info(f"Saved BM25 index with {len(self.documents)} documents")
+                f.write(msgpack.packb(
+                    {
+                        "ids": [d["id"] for d in documents],
+                        "texts": [d["text"] for d in documents],
+                        "metadatas": [d.get("metadata") or {} for d in documents],
+                    },
+                    use_bin_type=True,
+                ))
+            logger.info(f"Saved BM25 index with {len(documents)} documents")
         except Exception as e:
+            self.dirty = True
             logger.error(f"Failed to save BM25 index: {e}")
+
+    def clear(self):
+        """Drop every document (the source collection is empty) and save the empty index."""
+        with self._lock:
+            self.bm25 = SparseBM25([])
+            self.documents = []
+            self._positions = {}
+            self._postings_at_build = 0
+        self._save_index()
+
+    def save_if_dirty(self):
+        """Persist the index if updates arrived since the last save."""
+        if self.dirty and self.bm25 is not None:
+            self._save_index()
+
+    def needs_rebuild(self) -> bool:
+        """True once postings grew by `BM25_REBUILD_GROWTH` since the last full build.
+
+        Incremental updates only ever add or replace documents, so a periodic
+        rebuild from the source collection drops replaced postings and
+        documents deleted there.
+        """
+        bm25 = self.bm25
+        if bm25 is None:
+            return False
+        return bm25.n_postings > (1.0 + BM25_REBUILD_GROWTH) * self._postings_at_build
     
     def build_index(self, documents: List[Dict[str, Any]]):
         """Build BM25 index from documents.
@@ -63,9 +266,13 @@ class BM25Retriever:
             logger.warning("No documents provided for BM25 indexing")
             return
         
-        self.documents = documents
-        tokenized_corpus = [doc["text"].lower().split() for doc in documents]
-        self.bm25 = BM25Okapi(tokenized_corpus)
+        tokenized_corpus = [_tokenize(doc["text"]) for doc in documents]
+        bm25 = SparseBM25(tokenized_corpus)
+        with self._lock:
+            self.documents = documents
+            self._positions = {doc["id"]: i for i, doc in enumerate(documents)}
+            self.bm25 = bm25
+            self._postings_at_build = bm25.n_postings
         self._save_index()
         logger.info(f"Built BM25 index for {len(documents)} documents")
     
@@ -79,86 +286,166 @@ class BM25Retriever:
         Returns:
             List of dicts with 'id', 'text', 'metadata', 'score'
         """
-        if not self.bm25 or not self.documents:
+        with self._lock:
+            bm25, documents = self.bm25, self.documents
+            if bm25 is not None:
+                bm25.refresh()
+        if not bm25 or not documents:
             logger.warning("BM25 index not available")
             return []
         
-        tokenized_query = query.lower().split()
-        scores = self.bm25.get_scores(tokenized_query)
+        tokenized_query = _tokenize(query)
+        scores = bm25.get_scores(tokenized_query)
         
-        # Get top-k indices
-        top_indices = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]
+        # Get top-k indices: O(N) partition, then sort only the k survivors
+        k = min(top_k, scores.size)
+        if k <= 0:
+            return []
+        top_indices = np.argpartition(-scores, k - 1)[:k]
+        top_indices = top_indices[np.argsort(-scores[top_indices])]
+        # Only return results with positive scores
+        top_indices = top_indices[scores[top_indices] > 0]
         
         results = []
-        for idx in top_indices:
-            if scores[idx] > 0:  # Only return results with positive scores
-                doc = self.documents[idx].copy()
-                doc["score"] = float(scores[idx])
-                results.append(doc)
+        for idx, score in zip(top_indices.tolist(), scores[top_indices].tolist()):
+            doc = documents[idx].copy()
+            doc["score"] = score
+            results.append(doc)
         
         logger.info(f"BM25 retrieved {len(results)} results for query: {query[:50]}")
         return results
     
     def update_document(self, doc_id: str, text: str, metadata: Dict[str, Any]):
         """Update or add a single document to the index."""
-        # Check if document exists
-        existing_idx = None
-        for idx, doc in enumerate(self.documents):
-            if doc.get("id") == doc_id:
-                existing_idx = idx
-                break
-        
-        new_doc = {"id": doc_id, "text": text, "metadata": metadata}
-        
-        if existing_idx is not None:
-            self.documents[existing_idx] = new_doc
-        else:
-            self.documents.append(new_doc)
-        
-        # Rebuild index (could be optimized for incremental updates)
-        self.build_index(self.documents)
+        self.bulk_update([{"id": doc_id, "text": text, "metadata": metadata}])
+
+    def bulk_update(self, documents: List[Dict[str, Any]]):
+        """Add or replace documents incrementally.
+
+        Only the given documents are tokenized; idf and weights are
+        recomputed in bulk on the next search (or save). Nothing is written
+        to disk here: the index is marked dirty and saved by `save_if_dirty`.
+        """
+        if not documents:
+            return
+        tokenized = [_tokenize(doc["text"]) for doc in documents]
+        with self._lock:
+            if self.bm25 is None:
+                self.bm25 = SparseBM25([])
+                self.documents = []
+                self._positions = {}
+            for doc, tokens in zip(documents, tokenized):
+                pos = self._positions.get(doc["id"])
+                if pos is None:
+                    pos = self._positions[doc["id"]] = len(self.documents)
+                    self.documents.append(doc)
+                else:
+                    self.documents[pos] = doc
+                self.bm25.set_document(pos, tokens)
+            self.dirty = True
+        logger.info(f"Updated BM25 index with {len(documents)} documents")
+
+
+def enqueue_bm25_update(doc_id: str, text: str, metadata: Dict[str, Any] = None):
+    """Publish an ingested document to the BM25 update task (call from the event loop)."""
+    bm25_update_queue.put_nowait({"id": str(doc_id), "text": text, "metadata": metadata or {}})
+
+
+def _load_collection_documents(chroma_client, collection_name: str) -> List[Dict[str, Any]]:
+    collection = chroma_client.get_collection(collection_name)
+    data = collection.get()
+    ids = data.get("ids", []) or []
+    docs = data.get("documents", []) or []
+    metas = data.get("metadatas", []) or []
+    return [
+        {
+            "id": str(id_),
+            "text": str(docs[i]) if i < len(docs) else "",
+            "metadata": metas[i] if i < len(metas) else {},
+        }
+        for i, id_ in enumerate(ids)
+    ]
 
 
-async def start_bm25_rebuild_task(chroma_client, collection_name: str = "documents", interval_seconds: int = BM25_REBUILD_INTERVAL):
-    """Periodically rebuild BM25 index when new documents are detected in Chroma.
+def _collection_ids(chroma_client, collection_name: str) -> Set[str]:
+    """Ids stored in the collection (no documents or embeddings are read)."""
+    data = chroma_client.get_collection(collection_name).get(include=[])
+    return {str(id_) for id_ in data.get("ids", []) or []}
+
+
+async def start_bm25_rebuild_task(
+    chroma_client,
+    collection_name: str = "documents",
+    bm25_retriever: Optional[BM25Retriever] = None,
+):
+    """Keep the BM25 index in sync with Chroma from change notifications.
+    
+    The full collection is read when there is no on-disk index or the stored
+    index does not hold exactly the collection's ids (e.g. after a Chroma
+    reset or writes made while the app was down), and again
+    whenever postings have grown by `BM25_REBUILD_GROWTH` since the last full
+    build (which also drops documents deleted from Chroma). Otherwise the task
+    sleeps on `bm25_update_queue`, folds newly ingested documents in
+    incrementally, and saves the index at most every `BM25_SAVE_INTERVAL`
+    seconds, so it costs nothing while idle.
     
     Args:
         chroma_client: ChromaDB client instance
-        collection_name: Name of the ChromaDB collection to monitor
-        interval_seconds: Seconds between rebuild checks (default from env BM25_REBUILD_INTERVAL)
+        collection_name: Name of the ChromaDB collection to index
+        bm25_retriever: Retriever to update in place (e.g. the one serving queries);
+            a new instance is created if omitted
     """
-    bm25_retriever = BM25Retriever(collection_name=collection_name)
-    last_doc_count = -1
+    if bm25_retriever is None:
+        bm25_retriever = BM25Retriever(collection_name=collection_name)
     
-    try:
-        collection = chroma_client.get_collection(collection_name)
-    except Exception as e:
-        logger.warning(f"BM25 rebuild task: could not access collection '{collection_name}': {e}")
-        return
+    async def rebuild(reason: str):
+        try:
+            documents = await asyncio.to_thread(_load_collection_documents, chroma_client, collection_name)
+            if documents:
+                await asyncio.to_thread(bm25_retriever.build_index, documents)
+                logger.info(f"BM25 {reason} complete: {len(documents)} documents")
+        except Exception as e:
+            logger.warning(f"BM25 {reason}: could not read collection '{collection_name}': {e}")
     
+    if bm25_retriever.bm25 is None:
+        await rebuild("initial build")
+    else:
+        try:
+            stored = await asyncio.to_thread(_collection_ids, chroma_client, collection_name)
+        except Exception as e:
+            logger.warning(f"BM25 startup check: could not read collection '{collection_name}': {e}")
+        else:
+            with bm25_retriever._lock:
+                indexed = set(bm25_retriever._positions)
+            if indexed != stored:
+                logger.info(
+                    f"BM25 index out of sync with '{collection_name}' "
+                    f"({len(indexed)} indexed, {len(stored)} stored); rebuilding"
+                )
+                if stored:
+                    await rebuild("startup rebuild")
+                else:
+                    await asyncio.to_thread(bm25_retriever.clear)
+    
+    loop = asyncio.get_running_loop()
+    last_save = loop.time()
     while True:
+        # wake up for the pending save even when no further updates arrive
+        timeout = max(0.0, last_save + BM25_SAVE_INTERVAL - loop.time()) if bm25_retriever.dirty else None
         try:
-            data = collection.get()
-            ids = data.get("ids", []) or []
-            docs = data.get("documents", []) or []
-            metas = data.get("metadatas", []) or []
-            current_count = len(ids)
-            
-            if current_count != last_doc_count and current_count > 0:
-                bm25_docs = []
-                for i, id_ in enumerate(ids):
-                    bm25_docs.append({
-                        "id": str(id_),
-                        "text": str(docs[i]) if i < len(docs) else "",
-                        "metadata": metas[i] if i < len(metas) else {},
-                    })
-                bm25_retriever.build_index(bm25_docs)
-                last_doc_count = current_count
-                logger.info(f"BM25 periodic rebuild complete: {current_count} documents")
-            else:
-                logger.debug(f"BM25 periodic rebuild: no changes (count={current_count})")
+            first = await asyncio.wait_for(bm25_update_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            await asyncio.to_thread(bm25_retriever.save_if_dirty)
+            last_save = loop.time()
+            continue
+        batch = [first]
+        while len(batch) < BM25_UPDATE_BATCH and not bm25_update_queue.empty():
+            batch.append(bm25_update_queue.get_nowait())
+        try:
+            await asyncio.to_thread(bm25_retriever.bulk_update, batch)
         except Exception as e:
-            logger.error(f"BM25 periodic rebuild loop error: {e}")
-        
-        await asyncio.sleep(interval_seconds)
-
+            logger.error(f"BM25 update error: {e}")
+        if bm25_retriever.needs_rebuild():
+            # Chroma already holds every document queued so far
+            await rebuild("growth-triggered rebuild")
+            last_save = loop.time()
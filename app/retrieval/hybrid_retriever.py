@@ -1,9 +1,11 @@
 # app/retrieval/hybrid_retriever.py
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any, Optional
+import numpy as np
 from app.retrieval.bm25_retriever import BM25Retriever
-from app.retrieval.reranker import Reranker
+from app.retrieval.reranker import get_reranker
 from app.vector_store.chroma_client import get_chroma_client, query_texts
 
 logger = logging.getLogger(__name__)
@@ -11,6 +13,7 @@ logger = logging.getLogger(__name__)
 CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "documents")
 HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))  # Weight for dense retrieval (0=BM25 only, 1=vector only)
 USE_RERANKER = os.getenv("USE_RERANKER", "1") == "1"
+HYBRID_SEARCH_THREADS = int(os.getenv("HYBRID_SEARCH_THREADS", "4"))
 
 
 class HybridRetriever:
@@ -34,7 +37,9 @@ class HybridRetriever:
         
         self.bm25 = BM25Retriever(collection_name)
         self.chroma_client = get_chroma_client()
-        self.reranker = Reranker() if use_reranker else None
+        self.reranker = get_reranker() if use_reranker else None
+        # runs BM25 alongside the dense search; sized for concurrent /ask requests
+        self._pool = ThreadPoolExecutor(max_workers=HYBRID_SEARCH_THREADS, thread_name_prefix="bm25-search")
         
         logger.info(
             f"HybridRetriever initialized: collection={collection_name}, "
@@ -74,19 +79,89 @@ class HybridRetriever:
         Returns:
             List of documents with scores
         """
+        rerank_top_k = rerank_top_k or top_k
+        merged = self._candidates(query, top_k, bm25_top_k, vector_top_k, where, where_document)
+        
+        # 4. Reranking (optional)
+        if self.use_reranker and self.reranker and merged:
+            try:
+                merged = self.reranker.rerank(query, merged, top_k=rerank_top_k)
+                logger.info(f"Reranking complete: {len(merged)} results")
+            except Exception as e:
+                logger.error(f"Reranking failed: {e}")
+        
+        # Return top-k
+        return merged[:top_k]
+    
+    def retrieve_many(
+        self,
+        queries: List[str],
+        top_k: int = 10,
+        where: Optional[Dict[str, Any]] = None,
+        where_document: Optional[Dict[str, Any]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """Hybrid retrieval for several queries, reranked in a single batch.
+        
+        Returns:
+            One result list per query, in the order of `queries`
+        """
+        candidates = [
+            self._candidates(query, top_k, None, None, where, where_document) for query in queries
+        ]
+        if self.use_reranker and self.reranker and any(candidates):
+            try:
+                candidates = self.reranker.rerank_batch(queries, candidates, top_k=top_k)
+                logger.info(f"Batch reranking complete for {len(queries)} queries")
+            except Exception as e:
+                logger.error(f"Batch reranking failed: {e}")
+        return [merged[:top_k] for merged in candidates]
+    
+    def _candidates(
+        self,
+        query: str,
+        top_k: int,
+        bm25_top_k: Optional[int],
+        vector_top_k: Optional[int],
+        where: Optional[Dict[str, Any]],
+        where_document: Optional[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        """Dense + sparse retrieval fused with RRF, before reranking."""
         # Default retrieval counts
         bm25_top_k = bm25_top_k or (top_k * 3)
         vector_top_k = vector_top_k or (top_k * 3)
-        rerank_top_k = rerank_top_k or top_k
         
-        # 1. Dense retrieval (ChromaDB vector search)
+        # 1+2. Dense (ChromaDB) and sparse (BM25) retrieval are independent:
+        # score BM25 on the pool while the query is embedded and searched
+        sparse_future = self._pool.submit(self._sparse_search, query, bm25_top_k)
+        dense_results = self._dense_search(query, vector_top_k, where, where_document)
+        sparse_results = sparse_future.result()
+        
+        # 3. Hybrid fusion using Reciprocal Rank Fusion (RRF)
+        merged = self._reciprocal_rank_fusion(
+            dense_results, 
+            sparse_results, 
+            alpha=self.alpha,
+            k=60  # RRF constant
+        )
+        
+        logger.info(f"Hybrid fusion: {len(merged)} unique results")
+        return merged
+    
+    def _dense_search(
+        self,
+        query: str,
+        top_k: int,
+        where: Optional[Dict[str, Any]],
+        where_document: Optional[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        """Vector search in ChromaDB; returns [] on failure."""
         dense_results = []
         try:
             res = query_texts(
                 self.chroma_client,
                 self.collection_name,
                 query,
-                top_k=vector_top_k,
+                top_k=top_k,
                 where=where,
                 where_document=where_document,
             )
@@ -95,12 +170,14 @@ class HybridRetriever:
             metas = res.get("metadatas", [[]])[0] if isinstance(res.get("metadatas"), list) else []
             dists = res.get("distances", [[]])[0] if isinstance(res.get("distances"), list) else []
             
+            # Convert distances to similarities in one vector op
+            sims = (1.0 / (1.0 + np.asarray(dists, dtype=np.float32))).tolist()
             for i, id_ in enumerate(ids):
                 dense_results.append({
                     "id": str(id_),
                     "text": str(docs[i]) if i < len(docs) else "",
                     "metadata": metas[i] if i < len(metas) else {},
-                    "vector_score": 1.0 / (1.0 + float(dists[i])) if i < len(dists) else 0.0,  # Convert distance to similarity
+                    "vector_score": sims[i] if i < len(sims) else 0.0,
                 })
             logger.info(f"Dense retrieval: {len(dense_results)} results")
         except Exception as e:
@@ -114,35 +191,17 @@ class HybridRetriever:
                 )
             import traceback
             logger.debug(traceback.format_exc())
-        
-        # 2. Sparse retrieval (BM25)
-        sparse_results = []
+        return dense_results
+    
+    def _sparse_search(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        """BM25 search; returns [] on failure."""
         try:
-            sparse_results = self.bm25.search(query, top_k=bm25_top_k)
+            sparse_results = self.bm25.search(query, top_k=top_k)
             logger.info(f"BM25 retrieval: {len(sparse_results)} results")
+            return sparse_results
         except Exception as e:
             logger.error(f"BM25 retrieval failed: {e}")
-        
-        # 3. Hybrid fusion using Reciprocal Rank Fusion (RRF)
-        merged = self._reciprocal_rank_fusion(
-            dense_results, 
-            sparse_results, 
-            alpha=self.alpha,
-            k=60  # RRF constant
-        )
-        
-        logger.info(f"Hybrid fusion: {len(merged)} unique results")
-        
-        # 4. Reranking (optional)
-        if self.use_reranker and self.reranker and merged:
-            try:
-                merged = self.reranker.rerank(query, merged, top_k=rerank_top_k)
-                logger.info(f"Reranking complete: {len(merged)} results")
-            except Exception as e:
-                logger.error(f"Reranking failed: {e}")
-        
-        # Return top-k
-        return merged[:top_k]
+            return []
     
     def _reciprocal_rank_fusion(
         self, 
@@ -165,39 +224,39 @@ class HybridRetriever:
         Returns:
             Merged and sorted results
         """
-        # Create rank maps
-        doc_scores = {}
-        doc_data = {}
-        
-        # Process dense results
-        for rank, doc in enumerate(dense_results):
-            doc_id = doc["id"]
-            rrf_score = alpha / (k + rank + 1)
-            doc_scores[doc_id] = doc_scores.get(doc_id, 0) + rrf_score
-            if doc_id not in doc_data:
-                doc_data[doc_id] = doc
-                doc_data[doc_id]["retrieval_sources"] = []
-            doc_data[doc_id]["retrieval_sources"].append("vector")
-            doc_data[doc_id]["vector_rank"] = rank + 1
-        
-        # Process sparse results
-        for rank, doc in enumerate(sparse_results):
-            doc_id = doc["id"]
-            rrf_score = (1 - alpha) / (k + rank + 1)
-            doc_scores[doc_id] = doc_scores.get(doc_id, 0) + rrf_score
-            if doc_id not in doc_data:
-                doc_data[doc_id] = doc
-                doc_data[doc_id]["retrieval_sources"] = []
-            doc_data[doc_id]["retrieval_sources"].append("bm25")
-            doc_data[doc_id]["bm25_rank"] = rank + 1
-            if "bm25_score" in doc:
-                doc_data[doc_id]["bm25_score"] = doc["bm25_score"]
-        
-        # Sort by RRF score
+        n_dense = len(dense_results)
+        ids = [doc["id"] for doc in dense_results] + [doc["id"] for doc in sparse_results]
+        if not ids:
+            return []
+        
+        # Per-hit RRF contributions, summed per unique id in one bincount
+        weights = np.concatenate([
+            alpha / (k + np.arange(1, n_dense + 1)),
+            (1 - alpha) / (k + np.arange(1, len(sparse_results) + 1)),
+        ])
+        _, first, inv = np.unique(np.asarray(ids), return_index=True, return_inverse=True)
+        fused = np.bincount(inv, weights=weights)
+        
+        # The first occurrence of an id (dense before sparse) carries the annotations
+        all_results = dense_results + sparse_results
+        doc_data = [all_results[i] for i in first.tolist()]
+        for doc in doc_data:
+            doc["retrieval_sources"] = []
+        for rank, j in enumerate(inv[:n_dense].tolist()):
+            doc_data[j]["retrieval_sources"].append("vector")
+            doc_data[j]["vector_rank"] = rank + 1
+        for rank, j in enumerate(inv[n_dense:].tolist()):
+            doc = doc_data[j]
+            doc["retrieval_sources"].append("bm25")
+            doc["bm25_rank"] = rank + 1
+            if "bm25_score" in sparse_results[rank]:
+                doc["bm25_score"] = sparse_results[rank]["bm25_score"]
+        
+        # Sort by RRF score, ties in first-seen order
         merged = []
-        for doc_id, score in sorted(doc_scores.items(), key=lambda x: x[1], reverse=True):
-            doc = doc_data[doc_id]
-            doc["hybrid_score"] = score
+        for j in np.lexsort((first, -fused)).tolist():
+            doc = doc_data[j]
+            doc["hybrid_score"] = float(fused[j])
             merged.append(doc)
         
         return merged
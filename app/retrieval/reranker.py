@@ -1,7 +1,8 @@
 # app/retrieval/reranker.py
 import os
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 from sentence_transformers import CrossEncoder
 import torch
 
@@ -9,27 +10,74 @@ logger = logging.getLogger(__name__)
 
 RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
 RERANKER_DEVICE = os.getenv("RERANKER_DEVICE", "cuda" if torch.cuda.is_available() else "cpu")
-RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", "32"))
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", "64"))
+# fp32, fp16 (CUDA only), int8 (dynamic quantization, CPU only) or auto (fp16 on CUDA, fp32 otherwise)
+RERANKER_PRECISION = os.getenv("RERANKER_PRECISION", "auto").lower()
+# Characters of each document sent to the model; ~4 chars/token covers the
+# 512-token window, and anything beyond is discarded by the tokenizer anyway
+RERANKER_MAX_CHARS = int(os.getenv("RERANKER_MAX_CHARS", "2048"))
 
 
 class Reranker:
     """Cross-encoder reranker for improving retrieval quality."""
     
-    def __init__(self, model_name: str = RERANKER_MODEL, device: str = RERANKER_DEVICE):
+    def __init__(
+        self,
+        model_name: str = RERANKER_MODEL,
+        device: str = RERANKER_DEVICE,
+        precision: str = RERANKER_PRECISION,
+    ):
         self.model_name = model_name
         self.device = device
+        self.precision = precision
         self._model = None
-        logger.info(f"Reranker initialized with model: {model_name}, device: {device}")
+        self._load_lock = threading.Lock()
+        logger.info(f"Reranker initialized with model: {model_name}, device: {device}, precision: {precision}")
     
     @property
     def model(self):
         """Lazy load the model."""
         if self._model is None:
-            logger.info(f"Loading reranker model: {self.model_name}")
-            self._model = CrossEncoder(self.model_name, device=self.device)
-            logger.info("Reranker model loaded successfully")
+            # warmup and the first queries may race; load only once
+            with self._load_lock:
+                if self._model is None:
+                    logger.info(f"Loading reranker model: {self.model_name}")
+                    model = CrossEncoder(self.model_name, device=self.device)
+                    self._apply_precision(model)
+                    self._model = model
+                    logger.info("Reranker model loaded successfully")
         return self._model
     
+    def warmup(self):
+        """Load the model and run one tiny prediction so the first query skips model load and kernel setup."""
+        try:
+            self.model.predict([("warmup", "warmup")], show_progress_bar=False)
+            logger.info("Reranker warmup complete")
+        except Exception as e:
+            logger.warning(f"Reranker warmup failed: {e}")
+    
+    def _apply_precision(self, model: CrossEncoder):
+        """Convert the underlying transformer to the configured precision in place."""
+        on_cuda = str(self.device).startswith("cuda")
+        precision = self.precision
+        if precision == "auto":
+            precision = "fp16" if on_cuda else "fp32"
+        if precision == "fp16":
+            if not on_cuda:
+                logger.warning("RERANKER_PRECISION=fp16 needs CUDA; keeping fp32")
+                return
+            model.model.half()
+        elif precision == "int8":
+            if on_cuda:
+                logger.warning("RERANKER_PRECISION=int8 is CPU-only; keeping fp32")
+                return
+            # int8 weights for the Linear layers, activations quantized on the fly
+            model.model = torch.quantization.quantize_dynamic(model.model, {torch.nn.Linear}, dtype=torch.qint8)
+        elif precision != "fp32":
+            logger.warning(f"Unknown RERANKER_PRECISION '{self.precision}'; keeping fp32")
+            return
+        logger.info(f"Reranker running in {precision}")
+    
     def rerank(
         self, 
         query: str, 
@@ -46,27 +94,77 @@ class Reranker:
         Returns:
             Reranked list of documents with added 'rerank_score' field
         """
-        if not documents:
-            return []
+        return self.rerank_batch([query], [documents], top_k=top_k)[0]
+    
+    def rerank_batch(
+        self,
+        queries: List[str],
+        docs_per_query: List[List[Dict[str, Any]]],
+        top_k: Optional[int] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """Rerank the candidates of several queries in one model call.
         
-        # Prepare query-document pairs
-        pairs = [(query, doc.get("text", "")) for doc in documents]
+        Pairs from all queries are flattened into a single predict() so the
+        model sees full batches, then scores are scattered back per query.
+        
+        Args:
+            queries: Search queries
+            docs_per_query: Candidate documents for each query (same order)
+            top_k: Number of top results to return per query (None = return all)
+            
+        Returns:
+            One reranked list per query, documents with added 'rerank_score' field
+        """
+        if len(queries) != len(docs_per_query):
+            raise ValueError("queries and docs_per_query must have the same length")
+        
+        # Prepare query-document pairs, pre-truncated to what the model can read
+        pairs = [
+            (query, doc.get("text", "")[:RERANKER_MAX_CHARS])
+            for query, documents in zip(queries, docs_per_query)
+            for doc in documents
+        ]
+        if not pairs:
+            return [[] for _ in queries]
         
         # Get reranking scores in batches
         try:
-            scores = self.model.predict(pairs, batch_size=RERANKER_BATCH_SIZE, show_progress_bar=False)
+            scores = self.model.predict(
+                pairs, batch_size=RERANKER_BATCH_SIZE, show_progress_bar=False, convert_to_numpy=True
+            )
         except Exception as e:
             logger.error(f"Reranking failed: {e}")
-            return documents
+            return [list(documents) for documents in docs_per_query]
         
         # Add scores and sort
-        for doc, score in zip(documents, scores):
-            doc["rerank_score"] = float(score)
-        
-        reranked = sorted(documents, key=lambda x: x.get("rerank_score", 0), reverse=True)
-        
-        if top_k is not None:
-            reranked = reranked[:top_k]
+        results = []
+        offset = 0
+        for documents in docs_per_query:
+            for doc, score in zip(documents, scores[offset:offset + len(documents)].tolist()):
+                doc["rerank_score"] = score
+            offset += len(documents)
+            reranked = sorted(documents, key=lambda x: x.get("rerank_score", 0), reverse=True)
+            if top_k is not None:
+                reranked = reranked[:top_k]
+            results.append(reranked)
         
-        logger.info(f"Reranked {len(documents)} documents, returned top {len(reranked)}")
-        return reranked
+        logger.info(f"Reranked {len(pairs)} documents for {len(queries)} queries")
+        return results
+
+
+_rerankers: Dict[Tuple[str, str, str], Reranker] = {}
+_rerankers_lock = threading.Lock()
+
+
+def get_reranker(
+    model_name: str = RERANKER_MODEL,
+    device: str = RERANKER_DEVICE,
+    precision: str = RERANKER_PRECISION,
+) -> Reranker:
+    """Shared Reranker per (model, device, precision), so every retriever uses one loaded model."""
+    key = (model_name, device, precision)
+    with _rerankers_lock:
+        reranker = _rerankers.get(key)
+        if reranker is None:
+            reranker = _rerankers[key] = Reranker(model_name, device, precision)
+    return reranker
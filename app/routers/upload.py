@@ -2,9 +2,14 @@ from fastapi import APIRouter, UploadFile, File, HTTPException
 from typing import List
 from pydantic import BaseModel
 import os
+import asyncio
 import logging
+import tempfile
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from app.utils.docling_converter import convert_pdf_to_markdown
-import json
+from app.utils.file_registry import new_file_hasher
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +19,26 @@ router = APIRouter()
 MAX_FILE_SIZE_MB = 50  # 50 MB limit per file
 ALLOWED_EXTENSIONS = {".pdf"}
 MAX_FILES_PER_REQUEST = 10
+UPLOAD_CHUNK_BYTES = 1 << 20  # copy uploads to disk 1 MiB at a time
+# Concurrent Docling conversions; each holds its own models in memory
+CONVERT_WORKERS = int(os.getenv("CONVERT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Threads rather than processes: chunks are handed to the embedding workers
+# through enqueue_chunks_sync, which only reaches this process's event loop
+_CONVERT_POOL = ThreadPoolExecutor(max_workers=CONVERT_WORKERS, thread_name_prefix="convert")
+
+# One lock per converted_mds/<name>/ folder, across all requests; an entry
+# disappears once no upload holds or waits on it
+_output_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def _output_lock(md_dir: str, filename: str) -> asyncio.Lock:
+    """Lock for the output folder `filename` converts into (same-stem uploads share it)."""
+    key = os.path.join(md_dir, os.path.splitext(filename)[0])
+    lock = _output_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _output_locks[key] = lock
+    return lock
 
 # Response models
 class UploadErrorDetail(BaseModel):
@@ -32,6 +57,83 @@ class ConvertResponse(BaseModel):
     total_successful: int
     total_failed: int
 
+async def _save_upload(file: UploadFile, pdf_path: str) -> str:
+    """Copy an upload to `pdf_path` without holding it in memory; returns its registry fingerprint (hex).
+
+    The bytes go to a temporary file in the same directory that replaces
+    `pdf_path` only once complete, so a concurrent upload of the same name never
+    interleaves writes into one file. Raises ValueError (and removes the partial
+    file) if it is empty or too large.
+    """
+    max_bytes = MAX_FILE_SIZE_MB * 1024 * 1024
+    # reject early when the client-declared size is already over the limit
+    expected = getattr(file, "size", None)
+    if expected is not None and expected > max_bytes:
+        raise ValueError(f"File too large: {expected / (1024 * 1024):.1f}MB (max {MAX_FILE_SIZE_MB}MB)")
+    size = 0
+    # hash while copying so the converter's content cache needs no second pass over the file
+    digest = new_file_hasher()
+    # raw fd + os.write: one syscall per chunk, no Python buffering layer
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(pdf_path) or ".", prefix=".upload-", suffix=".part")
+    try:
+        try:
+            if expected and hasattr(os, "posix_fallocate"):
+                # reserve the whole file up front so it is laid out contiguously
+                os.posix_fallocate(fd, 0, expected)
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ValueError(f"File too large: more than {MAX_FILE_SIZE_MB}MB")
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(fd, view):]
+                digest.update(chunk)
+            if size == 0:
+                raise ValueError("File is empty")
+            # drop any preallocated tail if the declared size was too large
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, pdf_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest.hexdigest()
+
+async def _process_file(file: UploadFile, pdf_dir: str, md_dir: str) -> ConversionResult:
+    """Validate, save and convert one upload; raises ValueError for invalid input."""
+    # Validate file extension
+    filename = file.filename or "unknown"
+    file_ext = os.path.splitext(filename)[1].lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise ValueError(f"Invalid file type: {file_ext}. Only .pdf files allowed")
+    
+    # Uploads that share an output folder (from this or any concurrent request)
+    # are saved and converted one at a time, in arrival order
+    async with _output_lock(md_dir, filename):
+        # Stream to disk in fixed-size chunks, validating size as we go
+        pdf_path = os.path.join(pdf_dir, filename)
+        file_hash = await _save_upload(file, pdf_path)
+        
+        # Convert to Markdown off the event loop
+        logger.info(f"Converting {filename} to markdown")
+        loop = asyncio.get_running_loop()
+        md_path, chunks_count = await loop.run_in_executor(
+            _CONVERT_POOL, partial(convert_pdf_to_markdown, pdf_path, md_dir, file_hash=file_hash)
+        )
+    
+    logger.info(f"Successfully converted {filename} -> {chunks_count} chunks")
+    return ConversionResult(
+        filename=filename,
+        md_path=md_path,
+        chunks_count=chunks_count
+    )
+
 @router.post("/convert/", response_model=ConvertResponse)
 async def convert_pdf(files: List[UploadFile] = File(...)):
     """Convert PDF files to Markdown with chunking"""
@@ -50,66 +152,29 @@ async def convert_pdf(files: List[UploadFile] = File(...)):
     os.makedirs(pdf_dir, exist_ok=True)
     os.makedirs(md_dir, exist_ok=True)
     
+    # Files are saved and converted concurrently; results keep the upload order
+    outcomes = await asyncio.gather(
+        *(_process_file(file, pdf_dir, md_dir) for file in files),
+        return_exceptions=True,
+    )
+    
     successful: List[ConversionResult] = []
     failed: List[UploadErrorDetail] = []
     
-    for file in files:
-        try:
-            # Validate file extension
-            filename = file.filename or "unknown"
-            file_ext = os.path.splitext(filename)[1].lower()
-            if file_ext not in ALLOWED_EXTENSIONS:
-                raise ValueError(f"Invalid file type: {file_ext}. Only .pdf files allowed")
-            
-            # Read and validate file size
-            content = await file.read()
-            file_size_mb = len(content) / (1024 * 1024)
-            if file_size_mb > MAX_FILE_SIZE_MB:
-                raise ValueError(f"File too large: {file_size_mb:.1f}MB (max {MAX_FILE_SIZE_MB}MB)")
-            
-            if len(content) == 0:
-                raise ValueError("File is empty")
-            
-            # Save PDF
-            pdf_path = os.path.join(pdf_dir, filename)
-            with open(pdf_path, "wb") as f:
-                f.write(content)
-            
-            # Convert to Markdown
-            logger.info(f"Converting {filename} to markdown")
-            md_path = convert_pdf_to_markdown(pdf_path, md_dir)
-            
-            # Count chunks
-            chunks_count = 0
-            try:
-                folder = os.path.dirname(md_path)
-                chunks_json = os.path.join(folder, "chunks.json")
-                if os.path.exists(chunks_json):
-                    with open(chunks_json, "r", encoding="utf-8") as cf:
-                        data = json.load(cf)
-                        if isinstance(data, list):
-                            chunks_count = len(data)
-            except Exception as e:
-                logger.warning(f"Could not read chunks.json for {filename}: {e}")
-            
-            logger.info(f"Successfully converted {filename} -> {chunks_count} chunks")
-            successful.append(ConversionResult(
-                filename=filename,
-                md_path=md_path,
-                chunks_count=chunks_count
-            ))
-            
-        except ValueError as e:
-            logger.warning(f"Validation error for {file.filename}: {e}")
+    for file, outcome in zip(files, outcomes):
+        if isinstance(outcome, ConversionResult):
+            successful.append(outcome)
+        elif isinstance(outcome, ValueError):
+            logger.warning(f"Validation error for {file.filename}: {outcome}")
             failed.append(UploadErrorDetail(
                 filename=file.filename or "unknown",
-                error=str(e)
+                error=str(outcome)
             ))
-        except Exception as e:
-            logger.error(f"Conversion error for {file.filename}: {e}", exc_info=True)
+        else:
+            logger.error(f"Conversion error for {file.filename}: {outcome}", exc_info=outcome)
             failed.append(UploadErrorDetail(
                 filename=file.filename or "unknown",
-                error=f"Conversion failed: {str(e)}"
+                error=f"Conversion failed: {str(outcome)}"
             ))
     
     return ConvertResponse(
@@ -0,0 +1,176 @@
+"""On-disk chunk summaries shared by the chunkers.
+
+Chunks are stored as one compact msgpack file (`chunks.msgpack`) per document
+folder, next to a tiny human-readable `chunks_meta.json` holding the count and
+chunk ids. Folders written before the switch still have `chunks.json`, which
+`read_chunks` falls back to.
+
+Chunkers also keep a content-addressed cache under `<output_root>/.cache/`:
+one msgpack entry per input (keyed by a hash of its content) holding the
+exported markdown and the optimized chunks, so identical input skips Docling
+conversion and chunking entirely.
+"""
+from typing import List, Optional
+import os
+import hashlib
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import msgpack
+import orjson
+
+CHUNKS_FILE = "chunks.msgpack"
+CHUNKS_META_FILE = "chunks_meta.json"
+LEGACY_CHUNKS_FILE = "chunks.json"
+CHUNK_HASHES_FILE = ".chunk_hashes.json"
+CHUNK_WRITE_WORKERS = int(os.getenv("CHUNK_WRITE_WORKERS", "8"))
+CHUNK_CACHE_DIR = ".cache"
+# Cache entries kept decoded in memory for repeated ingests within one process
+CHUNK_CACHE_MEMO = int(os.getenv("CHUNK_CACHE_MEMO", "32"))
+# Part of every cache key; bump when chunking output changes for the same input
+CHUNK_CACHE_VERSION = 2
+
+# Per-chunk files are small, so writing them is syscall-latency bound; overlap them
+_write_pool = ThreadPoolExecutor(max_workers=CHUNK_WRITE_WORKERS, thread_name_prefix="chunk-write")
+
+
+def chunk_id(base_name: str, index: int) -> str:
+    return f"{base_name}__{index:03d}"
+
+
+def _write_if_changed(path: Path, data: bytes) -> bool:
+    """Write `data` to `path` unless the file already holds exactly these bytes."""
+    try:
+        if path.stat().st_size == len(data):
+            with open(path, "rb") as fh:
+                if fh.read() == data:
+                    return False
+    except OSError:
+        pass
+    with open(path, "wb") as fh:
+        fh.write(data)
+    return True
+
+
+def write_chunks(out_dir: Path, base_name: str, chunks: List[dict], content_key: Optional[str] = None) -> None:
+    """Write the chunk list and its meta summary into `out_dir`.
+
+    `content_key` records which input the chunks came from (see `chunks_current`).
+    Files whose serialized bytes are unchanged are left untouched.
+    """
+    # default=str keeps odd Docling meta values (paths, enums) serializable
+    _write_if_changed(out_dir / CHUNKS_FILE, msgpack.packb(chunks, use_bin_type=True, default=str))
+    meta = {"count": len(chunks), "chunk_ids": [chunk_id(base_name, i) for i in range(1, len(chunks) + 1)]}
+    if content_key:
+        meta["content_key"] = content_key
+    _write_if_changed(out_dir / CHUNKS_META_FILE, orjson.dumps(meta))
+
+
+def chunks_current(out_dir: Path, content_key: str) -> bool:
+    """True if `out_dir` already holds the chunks written for `content_key`."""
+    try:
+        with open(out_dir / CHUNKS_META_FILE, "rb") as fh:
+            return orjson.loads(fh.read()).get("content_key") == content_key
+    except (OSError, ValueError):
+        return False
+
+
+def _write_bytes(path: Path, data: bytes) -> None:
+    with open(path, "wb") as fh:
+        fh.write(data)
+
+
+def write_chunk_files(out_dir: Path, chunks: List[dict]) -> None:
+    """Write `chunk_###.md` for every chunk concurrently; raises the first write error.
+
+    Digests of the written files are kept in `.chunk_hashes.json`, so on re-runs
+    only chunks whose text changed (or whose file is gone) are rewritten.
+    """
+    hashes_path = out_dir / CHUNK_HASHES_FILE
+    try:
+        with open(hashes_path, "rb") as fh:
+            known = orjson.loads(fh.read())
+    except (OSError, ValueError):
+        known = {}
+
+    hashes = {}
+    futures = []
+    for i, c in enumerate(chunks, start=1):
+        name = f"chunk_{i:03}.md"
+        data = c.get("text", "").encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        hashes[name] = digest
+        if known.get(name) == digest and (out_dir / name).exists():
+            continue
+        futures.append(_write_pool.submit(_write_bytes, out_dir / name, data))
+    for fut in futures:
+        fut.result()
+    if hashes != known:
+        _write_bytes(hashes_path, orjson.dumps(hashes))
+
+
+def read_chunks(out_dir: Path) -> Optional[List[dict]]:
+    """Load the chunk list from `out_dir`, or None if none was written."""
+    path = out_dir / CHUNKS_FILE
+    if path.exists():
+        with open(path, "rb") as fh:
+            return msgpack.unpackb(fh.read(), raw=False)
+    legacy = out_dir / LEGACY_CHUNKS_FILE
+    if legacy.exists():
+        with open(legacy, "rb") as fh:
+            return orjson.loads(fh.read())
+    return None
+
+
+def _key_prefix(kind: str) -> bytes:
+    return f"{kind}:{CHUNK_CACHE_VERSION}".encode("utf-8") + b"\x00"
+
+
+def content_key(kind: str, text: str) -> str:
+    """Cache key for `text` chunked by the `kind` chunker."""
+    return hashlib.sha256(_key_prefix(kind) + text.encode("utf-8")).hexdigest()[:16]
+
+
+def file_content_key(kind: str, path: str) -> str:
+    """Cache key for the file at `path` chunked by the `kind` chunker."""
+    digest = hashlib.sha256(_key_prefix(kind))
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def _cache_path(output_root: str, key: str) -> Path:
+    return Path(output_root) / CHUNK_CACHE_DIR / f"{key}.msgpack"
+
+
+@lru_cache(maxsize=CHUNK_CACHE_MEMO)
+def _load_cache_entry(path: str, mtime_ns: int) -> dict:
+    # mtime_ns is part of the memo key so a rewritten entry is read again
+    with open(path, "rb") as fh:
+        return msgpack.unpackb(fh.read(), raw=False)
+
+
+def load_cached_chunks(output_root: str, key: str) -> Optional[dict]:
+    """Return the cache entry (`md`, `chunks`) for `key`, or None on a miss.
+
+    Entries may be shared between calls; treat them as read-only.
+    """
+    path = _cache_path(output_root, key)
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+        return _load_cache_entry(str(path), mtime_ns)
+    except (OSError, ValueError):
+        return None
+
+
+def store_cached_chunks(output_root: str, key: str, md_content: str, chunks: List[dict]) -> None:
+    """Record the markdown and optimized chunks produced for `key`."""
+    path = _cache_path(output_root, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, "wb") as fh:
+        fh.write(msgpack.packb({"md": md_content, "chunks": chunks}, use_bin_type=True, default=str))
+    os.replace(tmp, path)
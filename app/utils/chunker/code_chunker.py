@@ -1,28 +1,32 @@
 """Code-based chunking helpers.
 
-Uses Docling's code-aware chunking (via `StandardCodeChunkingStrategy`) and
-applies a small optimization that merges very small chunks into the previous
-chunk to avoid producing too many tiny fragments.
+Files in a known language (`CODE_EXT_LANG`) are split directly at top-level
+definitions (functions, classes, methods) into line ranges, without building a
+Docling document. Other files use Docling's code-aware chunking (via
+`StandardCodeChunkingStrategy`). Both paths then apply a small optimization
+that merges very small chunks into the previous chunk to avoid producing too
+many tiny fragments.
 
 When `output_dir` is provided (defaults to `converted_mds`), the function
 creates `converted_mds/<basename>/` and writes the converted markdown and
-chunks summary (`chunks.json`) and individual chunk files (`chunk_001.md`...).
+chunks summary (`chunks.msgpack`) and individual chunk files (`chunk_001.md`...).
 """
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional, Tuple
 import os
-import json
+import re
+import ast
+import threading
 from pathlib import Path
 
-from docling.document_converter import DocumentConverter
-from docling.datamodel.base_models import InputFormat
-from docling_core.transforms.chunker import HierarchicalChunker
-from docling_core.transforms.chunker.code_chunking.standard_code_chunking_strategy import (
-    StandardCodeChunkingStrategy,
-)
 from .optimizer import optimize_chunks
-from app.embeddings.worker import enqueue_chunk_sync
+from .markdown_chunker import get_document_converter
+from .chunk_store import write_chunks, write_chunk_files
+from app.embeddings.worker import enqueue_chunks_sync
 import logging
 
+if TYPE_CHECKING:
+    from docling_core.transforms.chunker import HierarchicalChunker
+
 logger = logging.getLogger(__name__)
 
 
@@ -36,28 +40,128 @@ CODE_EXT_LANG: dict[str, str] = {
 }
 
 
+# Longest chunk emitted by the line chunker; longer definitions are windowed
+CODE_CHUNK_MAX_LINES = int(os.getenv("CODE_CHUNK_MAX_LINES", "120"))
+
+_JS_DEF = r"^(?:export\s+)?(?:default\s+)?(?:async\s+)?(?:function\*?|class)\s+(\w+)|^(?:export\s+)?(?:const|let|var)\s+(\w+)\s*="
+# First line of a top-level definition; the first non-empty group is the symbol
+_DEF_PATTERNS: dict[str, "re.Pattern[str]"] = {
+    "python": re.compile(r"^(?:async\s+def|def|class)\s+(\w+)"),
+    "javascript": re.compile(_JS_DEF),
+    "typescript": re.compile(_JS_DEF + r"|^(?:export\s+)?(?:interface|type|enum)\s+(\w+)"),
+    # classes, plus methods at one level of indentation
+    "java": re.compile(
+        r"^(?:(?:public|private|protected|abstract|final|static)\s+)*(?:class|interface|enum|record)\s+(\w+)"
+        r"|^\s{2,4}(?:(?:public|private|protected|static|final|abstract|synchronized)\s+)+[\w<>\[\],.? ]+\s+(\w+)\s*\("
+    ),
+    # function definitions start at column 0 and the signature line does not end in ';'
+    "c": re.compile(r"^(?!(?:if|for|while|switch|return)\b)[A-Za-z_][\w\s\*]*?\b(\w+)\s*\([^;]*$"),
+}
+# Comment/decorator lines directly above a definition belong to its chunk
+# ('#' is a comment only in Python; in C it starts a preprocessor line)
+_LEADING_PREFIXES = ("@", "//", "/*", "*")
+_PY_LEADING_PREFIXES = ("@", "#")
+
+
+def _definition_starts(content: str, lines: List[str], lang: str) -> List[Tuple[int, Optional[str]]]:
+    """Return (0-based line, symbol) for each top-level definition, in order."""
+    if lang == "python":
+        try:
+            tree = ast.parse(content)
+            return [
+                (min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1, node.name)
+                for node in tree.body
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef))
+            ]
+        except (SyntaxError, ValueError):
+            pass  # fall back to the regex
+    pattern = _DEF_PATTERNS[lang]
+    starts = []
+    for i, line in enumerate(lines):
+        m = pattern.match(line)
+        if m:
+            starts.append((i, next((g for g in m.groups() if g), None)))
+    return starts
+
+
+def _chunk_code_by_lines(content: str, lang: str, max_lines: int = CODE_CHUNK_MAX_LINES) -> List[dict]:
+    """Split source into one chunk per top-level definition (plus the preamble).
+
+    Definitions longer than `max_lines` are split into consecutive windows.
+    Each chunk's meta records `language`, 1-based `start_line`/`end_line`
+    (inclusive) and the definition's `symbol` (None for the preamble).
+    """
+    lines = content.splitlines()
+    bounds: List[Tuple[int, Optional[str]]] = []
+    leading = _PY_LEADING_PREFIXES if lang == "python" else _LEADING_PREFIXES
+    prev = 0
+    for start, symbol in _definition_starts(content, lines, lang):
+        # pull leading comments/decorators into the definition's chunk
+        while start > prev and lines[start - 1].strip().startswith(leading):
+            start -= 1
+        if not bounds or start > bounds[-1][0]:
+            bounds.append((start, symbol))
+        prev = start + 1
+    if not bounds or bounds[0][0] != 0:
+        bounds.insert(0, (0, None))
+
+    chunks: List[dict] = []
+    ends = [start for start, _ in bounds[1:]] + [len(lines)]
+    for (start, symbol), end in zip(bounds, ends):
+        for w in range(start, end, max_lines):
+            w_end = min(w + max_lines, end)
+            text = "\n".join(lines[w:w_end])
+            if not text.strip():
+                continue
+            chunks.append({
+                "text": text,
+                "meta": {"language": lang, "start_line": w + 1, "end_line": w_end, "symbol": symbol},
+            })
+    return chunks
+
+
+_code_chunker: Optional["HierarchicalChunker"] = None
+_code_chunker_lock = threading.Lock()
+
+
+def _get_code_chunker() -> "HierarchicalChunker":
+    """Shared code-aware chunker; it holds no per-document state."""
+    global _code_chunker
+    if _code_chunker is None:
+        with _code_chunker_lock:
+            if _code_chunker is None:
+                from docling_core.transforms.chunker import HierarchicalChunker
+                from docling_core.transforms.chunker.code_chunking.standard_code_chunking_strategy import (
+                    StandardCodeChunkingStrategy,
+                )
+
+                _code_chunker = HierarchicalChunker(code_chunking_strategy=StandardCodeChunkingStrategy())
+    return _code_chunker
+
+
 def _ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 
 def _write_chunks_to_disk(chunks: List[dict], out_dir: Path, base_name: str, md_file: str) -> None:
     _ensure_dir(out_dir)
-    # write summary json
-    with open(out_dir / "chunks.json", "w", encoding="utf-8") as fh:
-        json.dump(chunks, fh, ensure_ascii=False, indent=2)
+    # write chunk summary
+    write_chunks(out_dir, base_name, chunks)
 
     # write individual chunk files
-    for i, ch in enumerate(chunks, start=1):
-        filename = f"chunk_{i:03}.md"
-        with open(out_dir / filename, "w", encoding="utf-8") as fh:
-            fh.write(ch.get("text", ""))
-        chunk_id = f"{base_name}__{i:03d}"
-        enqueue_chunk_sync(chunk_id, ch.get("text", ""), {"source_md": md_file, "chunk_index": i})
-        logger.info(f"Chunk {chunk_id} written and enqueued for embedding")
+    write_chunk_files(out_dir, chunks)
+    enqueue_chunks_sync([
+        (f"{base_name}__{i:03d}", ch.get("text", ""), {"source_md": md_file, "chunk_index": i})
+        for i, ch in enumerate(chunks, start=1)
+    ])
+    logger.info(f"{len(chunks)} chunks of {base_name} written and enqueued for embedding")
 
 
 def chunk_code_file(path: str, output_root: str = "converted_mds", min_lines_to_keep: int = 8) -> List[dict]:
-    """Chunk a code file at `path` using Docling's chunkers and persist outputs.
+    """Chunk a code file at `path` and persist outputs.
+
+    Known languages are split at definitions by `_chunk_code_by_lines`; other
+    files go through Docling's chunkers.
 
     Args:
         path: path to the code file
@@ -68,55 +172,69 @@ def chunk_code_file(path: str, output_root: str = "converted_mds", min_lines_to_
     Returns:
         List of chunk dicts with `text` and `meta`.
     """
-    ext = Path(path).suffix.lstrip(".").lower()
+    src = Path(path)
+    ext = src.suffix.lstrip(".").lower()
     lang = CODE_EXT_LANG.get(ext, "")
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
         content = f.read()
 
     md = f"```{lang}\n{content}\n```"
 
-    converter = DocumentConverter()
-    res = converter.convert_string(content=md, format=InputFormat.MD, name=Path(path).name)
-    doc = res.document
+    doc = None
+    if lang in _DEF_PATTERNS:
+        raw_chunks = _chunk_code_by_lines(content, lang)
+    else:
+        from docling.datamodel.base_models import InputFormat
 
-    chunker = HierarchicalChunker(code_chunking_strategy=StandardCodeChunkingStrategy())
-    raw_chunks = []
-    for ch in chunker.chunk(doc):
-        try:
-            meta = ch.meta.model_dump()
-        except Exception:
+        converter = get_document_converter()
+        res = converter.convert_string(content=md, format=InputFormat.MD, name=src.name)
+        doc = res.document
+
+        chunker = _get_code_chunker()
+        raw_chunks = []
+        for ch in chunker.chunk(doc):
             try:
-                meta = ch.meta.__dict__
+                meta = ch.meta.model_dump()
             except Exception:
-                meta = repr(ch.meta)
-        raw_chunks.append({"text": ch.text, "meta": meta})
-
-    # Simple optimization: merge small chunks into previous chunk
+                try:
+                    meta = ch.meta.__dict__
+                except Exception:
+                    meta = repr(ch.meta)
+            raw_chunks.append({"text": ch.text, "meta": meta})
+
+    # Simple optimization: merge small chunks into previous chunk.
+    # Texts are collected per output chunk and joined once, so many tiny
+    # chunks don't re-copy a growing string.
+    line_counts = [txt.count("\n") + 1 if txt else 0 for txt in (ch.get("text", "") for ch in raw_chunks)]
     merged: List[dict] = []
-    for ch in raw_chunks:
-        lines = len(ch.get("text", "").splitlines())
+    fragments: List[List[str]] = []
+    for ch, lines in zip(raw_chunks, line_counts):
         if merged and lines < min_lines_to_keep:
             # merge into previous
-            merged[-1]["text"] += "\n\n" + ch.get("text", "")
+            fragments[-1].append(ch.get("text", ""))
             # merge meta lists where possible
             try:
                 if isinstance(merged[-1]["meta"], dict) and isinstance(ch["meta"], dict):
-                    merged[-1]["meta"].update({"merged_from": merged[-1]["meta"].get("merged_from", []) + [ch["meta"]]})
+                    merged[-1]["meta"].setdefault("merged_from", []).append(ch["meta"])
                 else:
                     merged[-1]["meta"] = {"orig": merged[-1]["meta"], "merged": ch.get("meta")}
             except Exception:
                 merged[-1]["meta"] = {"note": "could_not_merge_meta"}
         else:
             merged.append(ch)
+            fragments.append([ch.get("text", "")])
+    for ch, parts in zip(merged, fragments):
+        if len(parts) > 1:
+            ch["text"] = "\n\n".join(parts)
 
     # persist outputs
-    base_name = Path(path).stem
+    base_name = src.stem
     out_dir = Path(output_root) / base_name
     _ensure_dir(out_dir)
 
-    # save the converted markdown
+    # save the converted markdown (the fenced source when Docling was skipped)
     try:
-        md_content = doc.export_to_markdown()
+        md_content = doc.export_to_markdown() if doc is not None else md
     except Exception:
         # fallback: reconstruct from chunks
         md_content = "\n\n".join([c["text"] for c in merged])
@@ -6,24 +6,28 @@ to the markdown chunker, and everything else to Docling's pipelines and
 the `HybridChunker` so that Docling does the heavy lifting. Outputs are
 persisted under `converted_mds/<basename>/`.
 """
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 import os
-import json
+import threading
 from pathlib import Path
 
-from docling.document_converter import DocumentConverter
-from docling.datamodel.base_models import InputFormat
-from docling_core.transforms.chunker import HierarchicalChunker, HybridChunker
-from docling_core.transforms.chunker.code_chunking.standard_code_chunking_strategy import (
-    StandardCodeChunkingStrategy,
-)
-
 from .code_chunker import chunk_code_file
-from .markdown_chunker import chunk_markdown_text
+from .markdown_chunker import chunk_markdown_text, enqueue_chunks, get_document_converter
 from .optimizer import optimize_chunks
-from app.embeddings.worker import enqueue_chunk_sync
+from .chunk_store import (
+    write_chunks,
+    write_chunk_files,
+    chunks_current,
+    content_key,
+    file_content_key,
+    load_cached_chunks,
+    store_cached_chunks,
+)
 import logging
 
+if TYPE_CHECKING:
+    from docling_core.transforms.chunker import HybridChunker
+
 logger = logging.getLogger(__name__)
 
 
@@ -31,11 +35,33 @@ EXT_CODE = {"py", "js", "ts", "java", "c", "cpp"}
 EXT_MD = {"md", "markdown"}
 
 
+_hybrid_chunker: Optional["HybridChunker"] = None
+_hybrid_chunker_lock = threading.Lock()
+
+
+def _get_hybrid_chunker() -> "HybridChunker":
+    """Shared `HybridChunker`; building one loads its tokenizer, and chunking
+    holds no per-document state."""
+    global _hybrid_chunker
+    if _hybrid_chunker is None:
+        with _hybrid_chunker_lock:
+            if _hybrid_chunker is None:
+                from docling_core.transforms.chunker import HybridChunker
+                from docling_core.transforms.chunker.code_chunking.standard_code_chunking_strategy import (
+                    StandardCodeChunkingStrategy,
+                )
+
+                _hybrid_chunker = HybridChunker(code_chunking_strategy=StandardCodeChunkingStrategy())
+    return _hybrid_chunker
+
+
 def _ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 
-def _write_chunks_summary(chunks: List[dict], out_dir: Path, base_name: str, md_content: str) -> None:
+def _write_chunks_summary(
+    chunks: List[dict], out_dir: Path, base_name: str, md_content: str, key: Optional[str] = None
+) -> None:
     _ensure_dir(out_dir)
     # write markdown only if it doesn't already exist (avoid overwriting)
     md_file = out_dir / f"{base_name}.md"
@@ -43,15 +69,11 @@ def _write_chunks_summary(chunks: List[dict], out_dir: Path, base_name: str, md_
         with open(md_file, "w", encoding="utf-8") as fh:
             fh.write(md_content)
 
-    with open(out_dir / "chunks.json", "w", encoding="utf-8") as fh:
-        json.dump(chunks, fh, ensure_ascii=False, indent=2)
+    write_chunks(out_dir, base_name, chunks, content_key=key)
 
-    for i, c in enumerate(chunks, start=1):
-        with open(out_dir / f"chunk_{i:03}.md", "w", encoding="utf-8") as fh:
-            fh.write(c.get("text", ""))
-        chunk_id = f"{base_name}__{i:03d}"
-        enqueue_chunk_sync(chunk_id, c.get("text", ""), {"source_md": str(md_file), "chunk_index": i})
-        logger.info(f"Chunk {chunk_id} written and enqueued for embedding")
+    write_chunk_files(out_dir, chunks)
+    enqueue_chunks(chunks, base_name, md_file)
+    logger.info(f"{len(chunks)} chunks of {base_name} written and enqueued for embedding")
 
 
 def chunk_source(
@@ -65,34 +87,57 @@ def chunk_source(
 
     Outputs are stored under `converted_mds/<basename>/` when `path` is
     provided (or when `name` can be inferred). Returns the list of chunks.
+    Input chunked before is served from the content cache under
+    `<output_root>/.cache/`.
     """
-    if path and not ext:
-        ext = Path(path).suffix.lstrip('.').lower()
+    src = Path(path) if path else None
+    if src and not ext:
+        ext = src.suffix
+    # normalize once so hints like ".MD" dispatch the same as a path suffix
+    ext = (ext or "").lstrip(".").lower()
 
     if ext in EXT_CODE and path:
         return chunk_code_file(path, output_root)
 
     if ext in EXT_MD and text is not None:
-        return chunk_markdown_text(text, name=(Path(path).name if path else "doc.md"), output_root=output_root)
-
-    if text is not None and (ext in EXT_MD):
-        return chunk_markdown_text(text, name=(Path(path).name if path else "doc.md"), output_root=output_root)
+        name = src.name if src else "doc.md"
+        return chunk_markdown_text(text, name=name, output_root=output_root)
 
-    converter = DocumentConverter()
-    if path:
-        res = converter.convert(path)
-        base_name = Path(path).stem
+    if src:
+        key = file_content_key("hybrid", path)
+        base_name = src.stem
     elif text is not None:
-        # assume markdown if no path given
-        res = converter.convert_string(content=text, format=InputFormat.MD)
+        key = content_key("hybrid", text)
         base_name = "text_input"
     else:
         raise ValueError("Either path or text must be provided")
+    out_dir = Path(output_root) / base_name
+
+    # identical input chunked before: skip Docling, and the writes too if
+    # this folder already holds those chunks
+    cached = load_cached_chunks(output_root, key)
+    if cached is not None:
+        if chunks_current(out_dir, key):
+            logger.info(f"{base_name} unchanged since last chunking; reusing {out_dir}")
+            # re-enqueue only what Chroma lacks (e.g. after a reset or a failed embed)
+            enqueue_chunks(cached["chunks"], base_name, out_dir / f"{base_name}.md", missing_only=True)
+        else:
+            _write_chunks_summary(cached["chunks"], out_dir, base_name, cached["md"], key)
+        return cached["chunks"]
+
+    from docling.datamodel.base_models import InputFormat
+
+    converter = get_document_converter()
+    if src:
+        res = converter.convert(path)
+    else:
+        # assume markdown if no path given
+        res = converter.convert_string(content=text, format=InputFormat.MD)
 
     doc = res.document
 
     # Use HybridChunker which combines page-aware and hierarchical strategies
-    chunker = HybridChunker(code_chunking_strategy=StandardCodeChunkingStrategy())
+    chunker = _get_hybrid_chunker()
     chunks = []
     for ch in chunker.chunk(doc):
         try:
@@ -105,7 +150,6 @@ def chunk_source(
         chunks.append({"text": ch.text, "meta": meta})
 
     # persist outputs
-    out_dir = Path(output_root) / base_name
     try:
         md_content = doc.export_to_markdown()
     except Exception:
@@ -114,6 +158,7 @@ def chunk_source(
     # optimize chunks for RAG
     optimized = optimize_chunks(chunks)
 
-    _write_chunks_summary(optimized, out_dir, base_name, md_content)
+    _write_chunks_summary(optimized, out_dir, base_name, md_content, key)
+    store_cached_chunks(output_root, key, md_content, optimized)
 
     return optimized
@@ -3,39 +3,119 @@
 Use Docling to convert/parse Markdown and then chunk using the
 `HierarchicalChunker`, which respects section headers. This is suitable for
 Markdown documents where you want chunks grouped by headings.
+
+Docling is imported on first use rather than at module import, so callers that
+only need the code chunker's line-based path never load it.
 """
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 import os
-import json
+import threading
 from pathlib import Path
 
-from docling.document_converter import DocumentConverter
-from docling.datamodel.base_models import InputFormat
-from docling_core.transforms.chunker import HierarchicalChunker
 from .optimizer import optimize_chunks
-from app.embeddings.worker import enqueue_chunk_sync
+from .chunk_store import (
+    write_chunks,
+    write_chunk_files,
+    chunks_current,
+    content_key,
+    load_cached_chunks,
+    store_cached_chunks,
+)
+from app.embeddings.worker import enqueue_chunks_sync
 from app.vector_store.chroma_client import get_chroma_client, filter_missing_ids
 import logging
 
+if TYPE_CHECKING:
+    from docling.document_converter import DocumentConverter
+    from docling_core.transforms.chunker import HierarchicalChunker
+    from docling_core.types.doc import DoclingDocument
+
 logger = logging.getLogger(__name__)
 CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "documents")
 
 
+_converter: Optional["DocumentConverter"] = None
+_converter_lock = threading.Lock()
+
+
+def get_document_converter() -> "DocumentConverter":
+    """Shared default `DocumentConverter`, created on first use.
+
+    Construction sets up Docling's format options and pipelines, so the
+    chunkers reuse one instance instead of paying that on every call.
+    """
+    global _converter
+    if _converter is None:
+        with _converter_lock:
+            if _converter is None:
+                from docling.document_converter import DocumentConverter
+
+                _converter = DocumentConverter()
+    return _converter
+
+
+_hier_chunker: Optional["HierarchicalChunker"] = None
+_hier_chunker_lock = threading.Lock()
+
+
+def _get_hierarchical_chunker() -> "HierarchicalChunker":
+    """Shared header-aware chunker; it holds no per-document state."""
+    global _hier_chunker
+    if _hier_chunker is None:
+        with _hier_chunker_lock:
+            if _hier_chunker is None:
+                from docling_core.transforms.chunker import HierarchicalChunker
+
+                _hier_chunker = HierarchicalChunker()
+    return _hier_chunker
+
+
 def _ensure_dir(p: Path) -> None:
     p.mkdir(parents=True, exist_ok=True)
 
 
-def chunk_markdown_text(text: str, name: str = "doc.md", output_root: str = "converted_mds") -> List[dict]:
-    """Chunk markdown text by headers using Docling's hierarchical chunker.
+def enqueue_chunks(chunks: List[dict], base_name: str, md_file: Path, missing_only: bool = False) -> None:
+    """Enqueue a document's chunks for embedding under their positional ids.
 
-    If `output_root` is provided, writes `converted_mds/<name_without_ext>/<name>.md`
-    and chunk files (`chunks.json` and `chunk_###.md`).
+    With `missing_only`, chunks whose id is already in Chroma are left out; use
+    it only when the folder is known to hold the chunks Chroma was built from.
+    Otherwise every chunk is enqueued: an existing id may hold older text, and
+    the embedding workers skip chunks whose stored content is unchanged.
     """
-    converter = DocumentConverter()
-    res = converter.convert_string(content=text, format=InputFormat.MD, name=name)
-    doc = res.document
+    chunk_ids = [f"{base_name}__{i:03d}" for i in range(1, len(chunks) + 1)]
+    wanted = None
+    if missing_only:
+        # determine which chunk ids are missing in Chroma to avoid duplicate ingestion
+        wanted = set(filter_missing_ids(get_chroma_client(), CHROMA_COLLECTION, chunk_ids))
+        skipped = len(chunk_ids) - len(wanted)
+        if skipped:
+            logger.info(f"{skipped} chunks of {base_name} already present in Chroma; skipping enqueue")
+    enqueue_chunks_sync([
+        (chunk_id, c.get("text", ""), {"source_md": str(md_file), "chunk_index": i})
+        for i, (chunk_id, c) in enumerate(zip(chunk_ids, chunks), start=1)
+        if wanted is None or chunk_id in wanted
+    ])
+
+
+def chunk_docling_document(
+    doc: "DoclingDocument",
+    name: str,
+    output_root: str = "converted_mds",
+    chunker: Optional["HierarchicalChunker"] = None,
+    key: Optional[str] = None,
+) -> List[dict]:
+    """Chunk an already-built `DoclingDocument` and persist/enqueue the chunks.
+
+    Lets callers that just converted a document (e.g. PDFs) chunk it directly
+    instead of re-parsing its exported markdown. `chunker` defaults to the
+    shared `HierarchicalChunker`; `key` records the result in the content cache.
+    The markdown file is only written if `<name>.md` does not exist yet.
+    """
+    base_name = Path(name).stem
+    out_dir = Path(output_root) / base_name
+    md_file = out_dir / f"{base_name}.md"
 
-    chunker = HierarchicalChunker()
+    chunker = chunker or _get_hierarchical_chunker()
     chunks = []
     for ch in chunker.chunk(doc):
         try:
@@ -49,8 +129,6 @@ def chunk_markdown_text(text: str, name: str = "doc.md", output_root: str = "con
         chunks.append({"text": ch.text, "meta": meta})
 
     # persist outputs
-    base_name = Path(name).stem
-    out_dir = Path(output_root) / base_name
     _ensure_dir(out_dir)
 
     try:
@@ -58,7 +136,6 @@ def chunk_markdown_text(text: str, name: str = "doc.md", output_root: str = "con
     except Exception:
         md_content = "\n\n".join([c["text"] for c in chunks])
 
-    md_file = out_dir / f"{base_name}.md"
     if not md_file.exists():
         with open(md_file, "w", encoding="utf-8") as fh:
             fh.write(md_content)
@@ -66,23 +143,50 @@ def chunk_markdown_text(text: str, name: str = "doc.md", output_root: str = "con
     # post-process chunks for RAG: merge/split and add overlap
     optimized = optimize_chunks(chunks)
 
-    # write chunks.json and individual chunk files
-    with open(out_dir / "chunks.json", "w", encoding="utf-8") as fh:
-        json.dump(optimized, fh, ensure_ascii=False, indent=2)
-
-    # determine which chunk ids are missing in Chroma to avoid duplicate ingestion
-    chunk_ids = [f"{base_name}__{i:03d}" for i in range(1, len(optimized) + 1)]
-    client = get_chroma_client()
-    missing_ids = set(filter_missing_ids(client, CHROMA_COLLECTION, chunk_ids))
-
-    for i, c in enumerate(optimized, start=1):
-        with open(out_dir / f"chunk_{i:03}.md", "w", encoding="utf-8") as fh:
-            fh.write(c.get("text", ""))
-        chunk_id = f"{base_name}__{i:03d}"
-        if chunk_id not in missing_ids:
-            logger.info(f"Chunk {chunk_id} already present in Chroma; skipping enqueue")
-            continue
-        enqueue_chunk_sync(chunk_id, c.get("text", ""), {"source_md": str(md_file), "chunk_index": i})
-        logger.info(f"Chunk {chunk_id} written and enqueued for embedding")
-
-    return chunks
+    # write the chunk summary and individual chunk files
+    write_chunks(out_dir, base_name, optimized, content_key=key)
+    write_chunk_files(out_dir, optimized)
+    if key:
+        store_cached_chunks(output_root, key, md_content, optimized)
+
+    enqueue_chunks(optimized, base_name, md_file)
+    return optimized
+
+
+def chunk_markdown_text(text: str, name: str = "doc.md", output_root: str = "converted_mds") -> List[dict]:
+    """Chunk markdown text by headers using Docling's hierarchical chunker.
+
+    If `output_root` is provided, writes `converted_mds/<name_without_ext>/<name>.md`
+    and chunk files (`chunks.msgpack` and `chunk_###.md`).
+
+    Returns the optimized chunks, i.e. exactly what was written to `chunks.msgpack`
+    and enqueued for embedding. Text chunked before is served from the content
+    cache under `<output_root>/.cache/` without running Docling again.
+    """
+    key = content_key("markdown", text)
+    cached = load_cached_chunks(output_root, key)
+    if cached is None:
+        from docling.datamodel.base_models import InputFormat
+
+        converter = get_document_converter()
+        res = converter.convert_string(content=text, format=InputFormat.MD, name=name)
+        return chunk_docling_document(res.document, name, output_root, key=key)
+
+    base_name = Path(name).stem
+    out_dir = Path(output_root) / base_name
+    md_file = out_dir / f"{base_name}.md"
+    optimized = cached["chunks"]
+    if chunks_current(out_dir, key):
+        logger.info(f"{name} unchanged since last chunking; reusing {out_dir}")
+        # re-enqueue only what Chroma lacks (e.g. after a reset or a failed embed)
+        enqueue_chunks(optimized, base_name, md_file, missing_only=True)
+    else:
+        _ensure_dir(out_dir)
+        if not md_file.exists():
+            with open(md_file, "w", encoding="utf-8") as fh:
+                fh.write(cached["md"])
+        write_chunks(out_dir, base_name, optimized, content_key=key)
+        write_chunk_files(out_dir, optimized)
+        # the folder held other content, so its ids may hold stale text in Chroma
+        enqueue_chunks(optimized, base_name, md_file)
+    return optimized
@@ -1,15 +1,18 @@
 import os
-import json
 import logging
+import threading
 from pathlib import Path
-from typing import Any
+from typing import Any, NamedTuple, Optional
 from docling.document_converter import DocumentConverter, PdfFormatOption
 from docling.datamodel.base_models import InputFormat
 from docling.datamodel.pipeline_options import PdfPipelineOptions, PictureDescriptionVlmOptions
-from app.utils.chunker.markdown_chunker import chunk_markdown_text
-from app.embeddings.worker import enqueue_chunk_sync
+from app.utils.chunker.markdown_chunker import chunk_docling_document
+from app.utils.chunker.chunk_store import read_chunks
+from app.embeddings.worker import enqueue_chunks_sync
 from app.vector_store.chroma_client import get_chroma_client, filter_missing_ids
 from app.utils.file_registry import get_file_registry
+from docling_core.transforms.chunker import HierarchicalChunker
+from docling_core.transforms.chunker.hierarchical_chunker import ChunkingDocSerializer, ChunkingSerializerProvider
 from docling_core.transforms.serializer.base import BaseDocSerializer, SerializationResult
 from docling_core.transforms.serializer.common import create_ser_result
 from docling_core.transforms.serializer.markdown import (MarkdownDocSerializer, MarkdownParams, MarkdownPictureSerializer)
@@ -19,55 +22,98 @@ logger = logging.getLogger(__name__)
 CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "documents")
 
 
-def _reenqueue_missing_chunks(md_path: str, output_dir: str) -> None:
-    """Re-enqueue any chunks whose vectors are missing from Chroma."""
+class ConversionInfo(NamedTuple):
+    md_path: str
+    chunks_count: int
+
+
+def _reenqueue_missing_chunks(md_path: str, output_dir: str) -> int:
+    """Re-enqueue any chunks whose vectors are missing from Chroma; returns the document's chunk count."""
+    chunks = []
     try:
         base_name = Path(md_path).stem
         out_dir = Path(output_dir) / base_name
-        chunks_json = out_dir / "chunks.json"
-        if not chunks_json.exists():
-            return
-        with open(chunks_json, "r", encoding="utf-8") as fh:
-            chunks = json.load(fh)
+        chunks = read_chunks(out_dir)
+        if chunks is None:
+            return 0
         chunk_ids = [f"{base_name}__{i:03d}" for i in range(1, len(chunks) + 1)]
         client = get_chroma_client()
         missing_ids = set(filter_missing_ids(client, CHROMA_COLLECTION, chunk_ids))
         if not missing_ids:
-            return
+            return len(chunks)
         logger.info(f"Re-enqueuing {len(missing_ids)} missing chunks for {base_name}")
-        for idx, chunk in enumerate(chunks, start=1):
-            chunk_id = f"{base_name}__{idx:03d}"
-            if chunk_id not in missing_ids:
-                continue
-            enqueue_chunk_sync(chunk_id, chunk.get("text", ""), {"source_md": str(out_dir / f"{base_name}.md"), "chunk_index": idx})
+        source_md = str(out_dir / f"{base_name}.md")
+        enqueue_chunks_sync([
+            (chunk_id, chunk.get("text", ""), {"source_md": source_md, "chunk_index": idx})
+            for idx, (chunk_id, chunk) in enumerate(zip(chunk_ids, chunks), start=1)
+            if chunk_id in missing_ids
+        ])
     except Exception as e:
         logger.warning(f"Failed to re-enqueue missing chunks for {md_path}: {e}")
+    return len(chunks)
 
 
-def convert_pdf_to_markdown(pdf_path: str, output_dir: str) -> str:
-    """Convert PDF to Markdown with VLM image descriptions replacing embedded images."""
-    
-    base_name = os.path.splitext(os.path.basename(pdf_path))[0]
-    out_folder = os.path.join(output_dir, base_name)
-    md_path = os.path.join(out_folder, base_name + ".md")
-    
-    # Check file registry: if hash matches and MD exists, skip conversion
-    registry = get_file_registry()
-    try:
-        current_hash = registry.compute_file_hash(pdf_path)
-        if registry.should_skip_conversion(pdf_path, current_hash):
-            logger.info(f"File hash matched in registry; skipping conversion for {base_name}")
-            if os.path.exists(md_path):
-                _reenqueue_missing_chunks(md_path, output_dir)
-            return md_path
-    except Exception as e:
-        logger.warning(f"File registry check failed for {pdf_path}: {e}")
-    
-    # Cache: if markdown already exists, re-enqueue any chunks missing in Chroma and return
-    if os.path.exists(md_path):
-        _reenqueue_missing_chunks(md_path, output_dir)
-        return md_path
-    
+class AnnotationPictureSerializer(MarkdownPictureSerializer):
+    def serialize(self, *, item: PictureItem, doc_serializer: BaseDocSerializer, 
+                 doc: DoclingDocument, **kwargs: Any) -> SerializationResult:
+        parts = []
+
+        # Get caption
+        try:
+            if hasattr(item, 'caption_text'):
+                caption = item.caption_text(doc)
+                if caption:
+                    parts.append(f"**Caption:** {caption.strip()}")
+        except Exception:
+            pass
+
+        # Get VLM annotations
+        for ann in getattr(item, "annotations", []):
+            if txt := getattr(ann, "text", None):
+                parts.append(f"**Description:** {txt.strip()}")
+
+        # Always emit text to replace the image, ensuring no images in output
+        if parts:
+            text = "\n\n".join(parts)
+        else:
+            text = "**[Image: description not available]**"
+
+        # Ensure proper markdown separation
+        text = "\n\n" + text.strip() + "\n\n"
+        return create_ser_result(text=text, span_source=item)
+
+
+class AnnotationSerializerProvider(ChunkingSerializerProvider):
+    """Chunk pictures as their caption/VLM description, like the exported markdown."""
+
+    def get_serializer(self, doc: DoclingDocument) -> ChunkingDocSerializer:
+        return ChunkingDocSerializer(doc=doc, picture_serializer=AnnotationPictureSerializer())
+
+
+_pdf_chunker: Optional[HierarchicalChunker] = None
+_pdf_chunker_lock = threading.Lock()
+
+
+def _get_pdf_chunker() -> HierarchicalChunker:
+    """Shared chunker for converted PDFs; pictures serialize as in the markdown."""
+    global _pdf_chunker
+    if _pdf_chunker is None:
+        with _pdf_chunker_lock:
+            if _pdf_chunker is None:
+                _pdf_chunker = HierarchicalChunker(serializer_provider=AnnotationSerializerProvider())
+    return _pdf_chunker
+
+
+# One converter per thread: Docling's pipeline (layout, OCR and VLM models) is
+# not documented as safe for concurrent convert() calls, so threads never share one
+_pdf_converters = threading.local()
+
+
+def _get_pdf_converter() -> DocumentConverter:
+    """This thread's PDF converter; Docling builds its pipeline (layout, OCR, VLM) once per thread and reuses it."""
+    converter = getattr(_pdf_converters, "converter", None)
+    if converter is not None:
+        return converter
     picture_description_options = PictureDescriptionVlmOptions(
         repo_id="HuggingFaceTB/SmolVLM-500M-Instruct",  # Upgraded from 256M for better descriptions
         prompt="""Describe this image in detail without missing any details and elements.
@@ -91,41 +137,54 @@ def convert_pdf_to_markdown(pdf_path: str, output_dir: str) -> str:
             InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
         }
     )
+    _pdf_converters.converter = converter
+    return converter
 
-    result = converter.convert(pdf_path)
 
-    try:
-        
+def convert_pdf_to_markdown(pdf_path: str, output_dir: str, file_hash: Optional[str] = None) -> ConversionInfo:
+    """Convert PDF to Markdown with VLM image descriptions replacing embedded images.
+
+    Returns the markdown path and the number of chunks produced for it.
 
-        class AnnotationPictureSerializer(MarkdownPictureSerializer):
-            def serialize(self, *, item: PictureItem, doc_serializer: BaseDocSerializer, 
-                         doc: DoclingDocument, **kwargs: Any) -> SerializationResult:
-                parts = []
-                
-                # Get caption
-                try:
-                    if hasattr(item, 'caption_text'):
-                        caption = item.caption_text(doc)
-                        if caption:
-                            parts.append(f"**Caption:** {caption.strip()}")
-                except Exception:
-                    pass
-                
-                # Get VLM annotations
-                for ann in getattr(item, "annotations", []):
-                    if txt := getattr(ann, "text", None):
-                        parts.append(f"**Description:** {txt.strip()}")
-
-                # Always emit text to replace the image, ensuring no images in output
-                if parts:
-                    text = "\n\n".join(parts)
-                else:
-                    text = "**[Image: description not available]**"
-                
-                # Ensure proper markdown separation
-                text = "\n\n" + text.strip() + "\n\n"
-                return create_ser_result(text=text, span_source=item)
+    `file_hash` is the registry fingerprint (`HASH_ALGO`) of the PDF if the
+    caller already has it (e.g. computed while saving the upload); otherwise it
+    is computed here once.
+    """
+    
+    base_name = os.path.splitext(os.path.basename(pdf_path))[0]
+    out_folder = os.path.join(output_dir, base_name)
+    md_path = os.path.join(out_folder, base_name + ".md")
+    
+    # Check file registry: if hash matches and MD exists, skip conversion
+    registry = get_file_registry()
+    current_hash = file_hash
+    try:
+        if current_hash is None:
+            current_hash = registry.compute_file_hash(pdf_path)
+        if registry.should_skip_conversion(pdf_path, current_hash):
+            logger.info(f"File hash matched in registry; skipping conversion for {base_name}")
+            chunks_count = 0
+            if os.path.exists(md_path):
+                chunks_count = _reenqueue_missing_chunks(md_path, output_dir)
+            return ConversionInfo(md_path, chunks_count)
+        # Identical content converted before under another name: reuse its output
+        cached_md = registry.find_by_hash(current_hash)
+        if cached_md and os.path.exists(cached_md):
+            logger.info(f"Content of {base_name} already converted as {cached_md}; skipping conversion")
+            registry.register_file(pdf_path, current_hash, cached_md)
+            chunks_count = _reenqueue_missing_chunks(cached_md, os.path.dirname(os.path.dirname(cached_md)))
+            return ConversionInfo(cached_md, chunks_count)
+    except Exception as e:
+        logger.warning(f"File registry check failed for {pdf_path}: {e}")
+    
+    # Cache: if markdown already exists, re-enqueue any chunks missing in Chroma and return
+    if os.path.exists(md_path):
+        return ConversionInfo(md_path, _reenqueue_missing_chunks(md_path, output_dir))
+    
+    converter = _get_pdf_converter()
+    result = converter.convert(pdf_path)
 
+    try:
         markdown_content = MarkdownDocSerializer(
             doc=result.document,
             picture_serializer=AnnotationPictureSerializer(),
@@ -141,17 +200,22 @@ def convert_pdf_to_markdown(pdf_path: str, output_dir: str) -> str:
 
     # Register file in registry after successful conversion
     try:
-        current_hash = registry.compute_file_hash(pdf_path)
+        if current_hash is None:
+            current_hash = registry.compute_file_hash(pdf_path)
         registry.register_file(pdf_path, current_hash, md_path)
     except Exception as e:
         logger.warning(f"Failed to register file in registry: {e}")
 
     # Now chunk the converted markdown and persist chunks in the same folder
+    chunks_count = 0
     try:
-        # chunk_markdown_text will create the same folder under output_dir/base_name
-        chunk_markdown_text(markdown_content, name=base_name + ".md", output_root=output_dir)
+        # chunk the converted document directly rather than re-parsing the markdown;
+        # this fills the same folder under output_dir/base_name
+        chunks_count = len(chunk_docling_document(
+            result.document, name=base_name + ".md", output_root=output_dir, chunker=_get_pdf_chunker()
+        ))
     except Exception:
         # If chunking fails, continue but surface the markdown path
         pass
 
-    return md_path
+    return ConversionInfo(md_path, chunks_count)
@@ -2,50 +2,103 @@
 import sqlite3
 import hashlib
 import logging
+import threading
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Dict, Iterable, Optional, Tuple
 import os
 
 logger = logging.getLogger(__name__)
 
 FILE_REGISTRY_DB = os.getenv("FILE_REGISTRY_DB", "file_registry.db")
+# Recent should_skip_conversion answers kept in memory (re-scans, retries)
+SKIP_MEMO_SIZE = 4096
+# Content fingerprint for change detection only (not security), so a fast hash will do.
+# Rows written with another algorithm (older registries used sha256) are re-verified
+# and upgraded on their next lookup.
+HASH_ALGO = "blake2b"
+
+
+def new_file_hasher(algo: str = HASH_ALGO):
+    """Fresh hashlib object for `algo`; feed it file bytes and take hexdigest()."""
+    if algo == "blake2b":
+        return hashlib.blake2b(digest_size=32)
+    return hashlib.new(algo)
+
+
+# Kept as one constant string so the connection's statement cache reuses the
+# compiled statement for every single-row and bulk registration
+_UPSERT_SQL = """
+    INSERT INTO files (file_path, file_hash, md_output_path, hash_algo, converted_at, updated_at)
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+    ON CONFLICT(file_path) DO UPDATE SET
+        file_hash = excluded.file_hash,
+        md_output_path = excluded.md_output_path,
+        hash_algo = excluded.hash_algo,
+        updated_at = CURRENT_TIMESTAMP
+"""
 
 
 class FileRegistry:
-    """SQLite-backed registry for tracking PDF file hashes and conversion state."""
+    """SQLite-backed registry for tracking PDF file hashes and conversion state.
+
+    One connection is kept open (WAL mode) and shared by the conversion threads
+    under a lock, instead of opening and fsyncing a new connection per call.
+    """
     
     def __init__(self, db_path: str = FILE_REGISTRY_DB):
         self.db_path = db_path
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        # file_path -> (hash, should_skip_conversion result); dropped when the path is re-registered
+        self._skip_memo: Dict[str, Tuple[str, bool]] = {}
         self._init_db()
     
     def _init_db(self):
         """Initialize the file registry database with schema if not exists."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._lock, self.conn as conn:
+                conn.execute("PRAGMA journal_mode=WAL;")
+                # WAL + NORMAL skips the per-transaction fsync that FULL requires
+                conn.execute("PRAGMA synchronous=NORMAL;")
+                conn.execute("PRAGMA temp_store=MEMORY;")
+                conn.execute("PRAGMA cache_size=-65536;")  # 64 MiB
+                # lookups read pages through the mapping instead of read() syscalls
+                conn.execute("PRAGMA mmap_size=268435456;")  # 256 MiB
                 conn.execute("""
                     CREATE TABLE IF NOT EXISTS files (
                         id INTEGER PRIMARY KEY AUTOINCREMENT,
                         file_path TEXT UNIQUE NOT NULL,
                         file_hash TEXT NOT NULL,
                         md_output_path TEXT,
+                        hash_algo TEXT NOT NULL DEFAULT 'sha256',
                         converted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                     )
                 """)
-                conn.commit()
-                logger.info(f"FileRegistry initialized at {self.db_path}")
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+                if "hash_algo" not in columns:
+                    # registries created before the column existed hold sha256 fingerprints
+                    conn.execute("ALTER TABLE files ADD COLUMN hash_algo TEXT NOT NULL DEFAULT 'sha256'")
+                # content lookups (same PDF uploaded under another name)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_files_hash ON files(file_hash)")
+                # path lookups use the UNIQUE index on file_path; this one only duplicated it
+                conn.execute("DROP INDEX IF EXISTS idx_files_path_cov")
+            logger.info(f"FileRegistry initialized at {self.db_path}")
         except Exception as e:
             logger.error(f"Failed to initialize FileRegistry: {e}")
             raise
     
-    def compute_file_hash(self, file_path: str) -> str:
-        """Compute SHA256 hash of a file."""
-        sha256_hash = hashlib.sha256()
+    def compute_file_hash(self, file_path: str, algo: str = HASH_ALGO) -> str:
+        """Compute the content fingerprint of a file (hex digest, `HASH_ALGO` by default)."""
         try:
             with open(file_path, "rb") as f:
-                for byte_block in iter(lambda: f.read(4096), b""):
-                    sha256_hash.update(byte_block)
-            return sha256_hash.hexdigest()
+                if hasattr(hashlib, "file_digest"):  # Python 3.11+: read/update loop runs in C
+                    return hashlib.file_digest(f, lambda: new_file_hasher(algo)).hexdigest()
+                file_hash = new_file_hasher(algo)
+                buf = memoryview(bytearray(1 << 20))
+                while n := f.readinto(buf):
+                    file_hash.update(buf[:n])
+                return file_hash.hexdigest()
         except Exception as e:
             logger.error(f"Failed to compute hash for {file_path}: {e}")
             raise
@@ -56,59 +109,122 @@ class FileRegistry:
         Returns:
             Tuple of (file_hash, md_output_path) or None if not found
         """
+        entry = self._get_entry(file_path)
+        return entry[:2] if entry else None
+    
+    def get_hash_algo(self, file_path: str) -> Optional[str]:
+        """Return the algorithm the stored fingerprint of a file was computed with, or None if not found."""
+        entry = self._get_entry(file_path)
+        return entry[2] if entry else None
+    
+    def _get_entry(self, file_path: str) -> Optional[Tuple[str, str, str]]:
+        """(file_hash, md_output_path, hash_algo) for a file, or None if not found."""
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.execute(
-                    "SELECT file_hash, md_output_path FROM files WHERE file_path = ?",
+            with self._lock:
+                row = self.conn.execute(
+                    "SELECT file_hash, md_output_path, hash_algo FROM files WHERE file_path = ?",
                     (file_path,)
-                )
-                row = cursor.fetchone()
-                return row if row else None
+                ).fetchone()
+            return row if row else None
         except Exception as e:
             logger.error(f"Failed to query FileRegistry for {file_path}: {e}")
             return None
     
+    def find_by_hash(self, file_hash: str) -> Optional[str]:
+        """Return the markdown output of any registered file with this content hash.
+        
+        Returns:
+            md_output_path of the most recently updated match, or None
+        """
+        try:
+            with self._lock:
+                row = self.conn.execute(
+                    """
+                    SELECT md_output_path FROM files
+                    WHERE file_hash = ? AND hash_algo = ? AND md_output_path IS NOT NULL
+                    ORDER BY updated_at DESC LIMIT 1
+                    """,
+                    (file_hash, HASH_ALGO)
+                ).fetchone()
+            return row[0] if row else None
+        except Exception as e:
+            logger.error(f"Failed to query FileRegistry for hash {file_hash[:12]}: {e}")
+            return None
+    
     def register_file(self, file_path: str, file_hash: str, md_output_path: str) -> bool:
         """Register or update a file in the registry.
         
         Args:
             file_path: Full path to the PDF file
-            file_hash: SHA256 hash of the file
+            file_hash: `HASH_ALGO` fingerprint of the file
             md_output_path: Path to the generated markdown file
             
         Returns:
             True if successful, False otherwise
         """
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.execute("""
-                    INSERT INTO files (file_path, file_hash, md_output_path, converted_at, updated_at)
-                    VALUES (?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                    ON CONFLICT(file_path) DO UPDATE SET
-                        file_hash = excluded.file_hash,
-                        md_output_path = excluded.md_output_path,
-                        updated_at = CURRENT_TIMESTAMP
-                """, (file_path, file_hash, md_output_path))
-                conn.commit()
-                logger.info(f"Registered file {file_path} with hash {file_hash[:12]}...")
-                return True
+            with self._lock, self.conn:
+                self.conn.execute(_UPSERT_SQL, (file_path, file_hash, md_output_path, HASH_ALGO))
+                self._skip_memo.pop(file_path, None)
+            logger.info(f"Registered file {file_path} with hash {file_hash[:12]}...")
+            return True
         except Exception as e:
             logger.error(f"Failed to register file {file_path}: {e}")
             return False
     
+    def register_files_bulk(self, entries: Iterable[Tuple[str, str, str]]) -> bool:
+        """Register many (file_path, file_hash, md_output_path) entries in one transaction.
+        
+        Returns:
+            True if successful, False otherwise (nothing is written on failure)
+        """
+        rows = [(path, file_hash, md_path, HASH_ALGO) for path, file_hash, md_path in entries]
+        if not rows:
+            return True
+        try:
+            with self._lock, self.conn:
+                self.conn.executemany(_UPSERT_SQL, rows)
+                for row in rows:
+                    self._skip_memo.pop(row[0], None)
+            logger.info(f"Registered {len(rows)} files")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to register {len(rows)} files: {e}")
+            return False
+    
     def should_skip_conversion(self, file_path: str, current_hash: str) -> bool:
         """Check if file conversion should be skipped (hash match in registry).
         
         Args:
             file_path: Full path to the PDF file
-            current_hash: Current SHA256 hash of the file
+            current_hash: Current `HASH_ALGO` fingerprint of the file
             
         Returns:
             True if file hash matches registry (skip conversion), False otherwise
+
+        Answers are memoized per path until that path is registered again.
         """
-        entry = self.get_file_entry(file_path)
+        memo = self._skip_memo.get(file_path)
+        if memo is not None and memo[0] == current_hash:
+            return memo[1]
+        skip = self._check_skip(file_path, current_hash)
+        with self._lock:
+            if len(self._skip_memo) >= SKIP_MEMO_SIZE:
+                self._skip_memo.clear()
+            self._skip_memo[file_path] = (current_hash, skip)
+        return skip
+    
+    def _check_skip(self, file_path: str, current_hash: str) -> bool:
+        entry = self._get_entry(file_path)
         if entry:
-            stored_hash, md_path = entry
+            stored_hash, md_path, stored_algo = entry
+            if stored_algo != HASH_ALGO:
+                # legacy fingerprint: verify it once with its own algorithm, then upgrade the row
+                if md_path and self.compute_file_hash(file_path, stored_algo) == stored_hash:
+                    self.register_file(file_path, current_hash, md_path)
+                    logger.info(f"File {file_path} unchanged (legacy {stored_algo} match); skipping conversion")
+                    return True
+                return False
             if stored_hash == current_hash and md_path:
                 logger.info(f"File {file_path} unchanged (hash match); skipping conversion")
                 return True
@@ -116,15 +232,19 @@ class FileRegistry:
     
     def cleanup(self):
         """Close database connection."""
-        if hasattr(self, 'db_path'):
-            logger.info("FileRegistry cleanup complete")
+        with self._lock:
+            self.conn.close()
+        logger.info("FileRegistry cleanup complete")
 
 # Global singleton instance
 _registry: Optional[FileRegistry] = None
+_registry_lock = threading.Lock()
 
 def get_file_registry() -> FileRegistry:
     """Get or create the global FileRegistry instance."""
     global _registry
     if _registry is None:
-        _registry = FileRegistry()
+        with _registry_lock:
+            if _registry is None:
+                _registry = FileRegistry()
     return _registry
@@ -1,32 +1,77 @@
 # app/vector_store/chroma_client.py
 import os
-from typing import Any, Dict, List, Optional
-import chromadb
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Union
+import numpy as np
 import logging
-from app.embeddings.ollama_embeddings import embed_texts
+from app.embeddings._kernels import l2_normalize
 
 logger = logging.getLogger(__name__)
 
 CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "chroma_db")
 CHROMA_METRIC = os.getenv("CHROMA_METRIC", "cosine")
 EMBED_MODEL = os.getenv("EMBED_MODEL", "bge-m3")
+# HNSW graph parameters for new collections (Chroma's defaults); larger M / ef trade
+# memory and build time for recall
+CHROMA_HNSW_M = int(os.getenv("CHROMA_HNSW_M", "16"))
+CHROMA_HNSW_CONSTRUCTION_EF = int(os.getenv("CHROMA_HNSW_CONSTRUCTION_EF", "100"))
+CHROMA_HNSW_SEARCH_EF = int(os.getenv("CHROMA_HNSW_SEARCH_EF", "10"))
+# Distinct query strings whose embeddings are kept in memory
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "512"))
 
 _client = None
 
 def get_chroma_client():
-    """Get or create ChromaDB persistent client. Uses modern PersistentClient API."""
+    """Get or create ChromaDB persistent client. Uses modern PersistentClient API.
+
+    chromadb is imported here so modules that only import this one stay cheap to load.
+    """
     global _client
     if _client is None:
+        import chromadb
+
         _client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
         logger.info(f"ChromaDB PersistentClient initialized at {CHROMA_PERSIST_DIR}")
     return _client
 
 
+# (client, collection name) -> collection handle; get_collection costs a metadata lookup per call
+_collections: Dict[Tuple[int, str], Any] = {}
+_collections_lock = threading.Lock()
+
+
 def _get_or_create_collection(client, collection_name: str):
-    try:
-        return client.get_collection(collection_name)
-    except Exception:
-        return client.create_collection(name=collection_name, metadata={"distance": CHROMA_METRIC})
+    key = (id(client), collection_name)
+    collection = _collections.get(key)
+    if collection is not None:
+        return collection
+    with _collections_lock:
+        collection = _collections.get(key)
+        if collection is not None:
+            return collection
+        try:
+            collection = client.get_collection(collection_name)
+        except Exception:
+            # Chroma reads index settings from "hnsw:*" keys; space and M are fixed at creation
+            collection = client.create_collection(
+                name=collection_name,
+                metadata={
+                    "hnsw:space": CHROMA_METRIC,
+                    "hnsw:M": CHROMA_HNSW_M,
+                    "hnsw:construction_ef": CHROMA_HNSW_CONSTRUCTION_EF,
+                    "hnsw:search_ef": CHROMA_HNSW_SEARCH_EF,
+                },
+            )
+        _collections[key] = collection
+        return collection
+
+
+def drop_collection(client, collection_name: str) -> None:
+    """Delete a collection and forget its cached handle."""
+    with _collections_lock:
+        _collections.pop((id(client), collection_name), None)
+        client.delete_collection(collection_name)
 
 
 def filter_missing_ids(client, collection_name: str, ids: List[str]) -> List[str]:
@@ -46,6 +91,52 @@ def filter_missing_ids(client, collection_name: str, ids: List[str]) -> List[str
         return ids
 
 
+def filter_changed(client, collection_name: str, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]) -> List[int]:
+    """Return positions whose id is not stored yet or whose stored document/metadata differ.
+
+    Chunk ids are positional, so an existing id alone does not mean the content is unchanged.
+    If the lookup fails, conservatively return every position (so we re-ingest).
+    """
+    if not ids:
+        return []
+    try:
+        collection = _get_or_create_collection(client, collection_name)
+        res = collection.get(ids=ids, include=["documents", "metadatas"])
+        stored = {
+            id_: (doc, meta or {})
+            for id_, doc, meta in zip(res.get("ids") or [], res.get("documents") or [], res.get("metadatas") or [])
+        }
+        return [
+            i for i, (id_, doc, meta) in enumerate(zip(ids, documents, metadatas))
+            if stored.get(id_) != (doc, meta or {})
+        ]
+    except Exception as e:
+        logger.warning(f"Chroma changed-content check failed for {collection_name}: {e}")
+        return list(range(len(ids)))
+
+
+@lru_cache(maxsize=QUERY_EMBED_CACHE_SIZE)
+def _embed_query(query: str, model: str) -> np.ndarray:
+    """Normalized float32 embedding of a query; repeated queries skip the Ollama round trip.
+
+    Failures raise and are not cached. The returned array is shared, so it is read-only.
+    """
+    from app.embeddings.ollama_embeddings import embed_texts
+
+    embedding_result = embed_texts([query], model=model)
+    if not embedding_result or len(embedding_result) == 0:
+        logger.error(f"Embedding generation returned empty result for query: {query[:50]}")
+        raise ValueError(f"Failed to generate embedding for query using model {model}")
+    # normalize like the ingested vectors so distances are on the same scale;
+    # kept as a contiguous float32 row, Chroma takes numpy arrays (no per-float Python objects)
+    query_embedding = l2_normalize(np.array(embedding_result[0], dtype=np.float32).reshape(1, -1))[0]
+    if query_embedding.size == 0:
+        logger.error(f"Generated embedding is empty for query: {query[:50]}")
+        raise ValueError(f"Empty embedding generated for query using model {model}")
+    query_embedding.setflags(write=False)
+    return query_embedding
+
+
 def query_texts(client, collection_name: str, query: str, top_k: int = 5, where: Optional[Dict[str, Any]] = None, where_document: Optional[Dict[str, Any]] = None):
     """Query Chroma with a text question using the configured embed model."""
     try:
@@ -62,20 +153,8 @@ def query_texts(client, collection_name: str, query: str, top_k: int = 5, where:
             logger.warning("Empty query provided, returning empty results")
             return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
         
-        # Generate query embedding
-        embedding_result = embed_texts([query.strip()], model=EMBED_MODEL)
-        
-        # Validate embedding result
-        if not embedding_result or len(embedding_result) == 0:
-            logger.error(f"Embedding generation returned empty result for query: {query[:50]}")
-            raise ValueError(f"Failed to generate embedding for query using model {EMBED_MODEL}")
-        
-        query_embedding = embedding_result[0].tolist()
-        
-        # Validate embedding is not empty
-        if not query_embedding or len(query_embedding) == 0:
-            logger.error(f"Generated embedding is empty for query: {query[:50]}")
-            raise ValueError(f"Empty embedding generated for query using model {EMBED_MODEL}")
+        # Generate (or reuse) the normalized query embedding
+        query_embedding = _embed_query(query.strip(), EMBED_MODEL)
         
         logger.debug(f"Query embedding dimension: {len(query_embedding)}")
         
@@ -99,7 +178,7 @@ def query_texts(client, collection_name: str, query: str, top_k: int = 5, where:
         # Check for dimension mismatch
         error_str = str(e).lower()
         if "dimension" in error_str or "size" in error_str or "shape" in error_str or "index" in error_str:
-            if 'query_embedding' in locals() and query_embedding:
+            if 'query_embedding' in locals() and query_embedding.size:
                 logger.error(f"Query embedding dimension: {len(query_embedding)}")
             else:
                 logger.error("Query embedding was not generated or is empty")
@@ -113,7 +192,47 @@ def query_texts(client, collection_name: str, query: str, top_k: int = 5, where:
                 pass
         raise
 
-def ingest_batch(client, collection_name: str, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: List[List[float]]):
+def query_texts_batch(client, collection_name: str, queries: List[str], top_k: int = 5, where: Optional[Dict[str, Any]] = None, where_document: Optional[Dict[str, Any]] = None):
+    """Query several questions with one embedding request and one Chroma query.
+
+    Returns the same shape as `query_texts`, with one row per entry in `queries`
+    (in order); empty or whitespace-only queries get empty rows.
+    """
+    keys = ("ids", "documents", "metadatas", "distances")
+    result = {k: [[] for _ in queries] for k in keys}
+    collection = _get_or_create_collection(client, collection_name)
+    count = collection.count()
+    if count == 0:
+        logger.warning(f"Collection '{collection_name}' is empty, returning empty results")
+        return result
+
+    positions = [i for i, q in enumerate(queries) if q and q.strip()]
+    if not positions:
+        logger.warning("Only empty queries provided, returning empty results")
+        return result
+
+    from app.embeddings.ollama_embeddings import embed_texts
+
+    texts = [queries[i].strip() for i in positions]
+    embedding_result = embed_texts(texts, model=EMBED_MODEL)
+    if len(embedding_result) != len(texts):
+        raise ValueError(f"Got {len(embedding_result)} embeddings for {len(texts)} queries using model {EMBED_MODEL}")
+    query_embeddings = l2_normalize(np.asarray(embedding_result, dtype=np.float32))
+
+    query_params = {"query_embeddings": query_embeddings, "n_results": min(top_k, count)}
+    if where:
+        query_params["where"] = where
+    if where_document:
+        query_params["where_document"] = where_document
+    res = collection.query(**query_params)
+
+    for k in keys:
+        rows = res.get(k) or []
+        for row, i in zip(rows, positions):
+            result[k][i] = row
+    return result
+
+def ingest_batch(client, collection_name: str, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: Union[np.ndarray, List[List[float]]]):
     logger.info(f"Ingesting batch of {len(ids)} items to Chroma collection '{collection_name}'")
     
     # Validate input lengths match
@@ -126,36 +245,26 @@ def ingest_batch(client, collection_name: str, ids: List[str], documents: List[s
         raise ValueError("All input lists must have the same length")
     
     # Validate embeddings are not empty
-    for i, emb in enumerate(embeddings):
-        if not emb or len(emb) == 0:
-            logger.error(f"Empty embedding at index {i} for id {ids[i]}")
-            raise ValueError(f"Empty embedding found at index {i}")
+    if isinstance(embeddings, np.ndarray):
+        # (N, D) matrix: every row has the same dimension, so one shape check suffices
+        if embeddings.ndim != 2 or embeddings.shape[1] == 0:
+            logger.error(f"Invalid embedding matrix shape {embeddings.shape}")
+            raise ValueError(f"Invalid embedding matrix shape {embeddings.shape}")
+    else:
+        for i, emb in enumerate(embeddings):
+            if emb is None or len(emb) == 0:
+                logger.error(f"Empty embedding at index {i} for id {ids[i]}")
+                raise ValueError(f"Empty embedding found at index {i}")
     
     # Ensure collection exists
     collection = _get_or_create_collection(client, collection_name)
     
     try:
-        # Attempt direct add
-        collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
-        logger.info(f"Successfully added {len(ids)} items to Chroma")
+        # one write transaction whether the ids are new or being re-ingested
+        collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+        logger.info(f"Successfully upserted {len(ids)} items to Chroma")
     except Exception as e:
-        error_msg = str(e).lower()
-        if "duplicate" in error_msg or "already exists" in error_msg:
-            logger.warning(f"Duplicate IDs detected, attempting upsert via delete-then-add: {e}")
-            try:
-                # Delete existing items then re-add
-                for id_ in ids:
-                    try:
-                        collection.delete(ids=[id_])
-                    except Exception:
-                        pass
-                collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
-                logger.info(f"Successfully upserted {len(ids)} items to Chroma after delete")
-            except Exception as e2:
-                logger.error(f"Chroma upsert failed: {e2}")
-                raise
-        else:
-            logger.error(f"Chroma add failed with error: {e}")
-            raise
+        logger.error(f"Chroma upsert failed: {e}")
+        raise
     
     logger.info(f"Batch ingestion complete - {len(ids)} items stored in {collection_name}")
\ No newline at end of file
@@ -2,8 +2,39 @@
 """Reset all caches and databases - useful after fixing embedding issues."""
 
 import os
-import shutil
+import glob
+import fnmatch
 import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Concurrent unlinks; deletion is syscall-latency bound on large vector stores
+RMTREE_WORKERS = 16
+
+
+def _fast_rmtree(path):
+    """Remove a directory tree, unlinking its files from a thread pool.
+
+    Directories are collected while walking and removed deepest first once
+    their files are gone. Symlinks are unlinked, never followed.
+    """
+    files = []
+    dirs = [path]
+    i = 0
+    while i < len(dirs):
+        with os.scandir(dirs[i]) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                else:
+                    files.append(entry.path)
+        i += 1
+    with ThreadPoolExecutor(max_workers=RMTREE_WORKERS) as pool:
+        # list() re-raises the first unlink error
+        list(pool.map(os.unlink, files))
+    # breadth-first order lists parents before children, so reversed is bottom-up
+    for d in reversed(dirs):
+        os.rmdir(d)
+
 
 def reset_all_caches():
     """Remove all cache databases and vector stores."""
@@ -16,6 +47,9 @@ def reset_all_caches():
         ("embeddings_cache.sqlite3", "Embeddings cache"),
         ("embeddings_cache.sqlite3-shm", "Embeddings cache (shared memory)"),
         ("embeddings_cache.sqlite3-wal", "Embeddings cache (write-ahead log)"),
+        ("embeddings_cache.*.f32", "Embeddings cache (vector matrix)"),
+        ("embeddings_cache.*.i8", "Embeddings cache (quantized vector matrix)"),
+        ("embed_batch_state.json", "Embedding batch size state"),
         ("file_registry.db", "File registry"),
         ("chroma_db/", "ChromaDB vector store"),
         ("bm25_index/", "BM25 sparse index"),
@@ -25,16 +59,30 @@ def reset_all_caches():
     not_found = []
     errors = []
     
+    # every item lives in the working directory: one listing instead of a stat per item
+    entries = {e.name: e for e in os.scandir(".")}
+    
+    # expand wildcard entries (one matrix file per embedding dimension) from the same listing
+    items_to_remove = [
+        (path, description)
+        for item, description in items_to_remove
+        for path in (sorted(fnmatch.filter(entries, item)) if glob.has_magic(item) else [item])
+    ]
+    
     for item, description in items_to_remove:
         try:
-            if os.path.exists(item):
-                if os.path.isdir(item):
-                    shutil.rmtree(item)
+            entry = entries.get(item.rstrip("/"))
+            if entry is None:
+                not_found.append(f"  - Not found: {description} ({item})")
+            else:
+                if entry.is_dir(follow_symlinks=False):
+                    _fast_rmtree(entry.path)
                 else:
-                    os.remove(item)
+                    os.unlink(entry.path)
                 removed.append(f"  ✓ Removed: {description} ({item})")
-            else:
-                not_found.append(f"  - Not found: {description} ({item})")
+        except FileNotFoundError:
+            # gone since the listing (e.g. -wal/-shm removed when SQLite closed)
+            not_found.append(f"  - Not found: {description} ({item})")
         except Exception as e:
             errors.append(f"  ✗ Error removing {item}: {e}")
     
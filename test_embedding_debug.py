@@ -2,22 +2,90 @@
 """Quick test with debug logging enabled."""
 
 import sys
+import time
 import logging
-
-# Enable DEBUG logging
-logging.basicConfig(level=logging.DEBUG, format='%(name)s - %(levelname)s - %(message)s')
+import numpy as np
 
 sys.path.insert(0, '/home/lathiss/Projects/RAG_PIPELINE')
 
 from app.embeddings.ollama_embeddings import embed_texts
 
-print("Testing Ollama embedding with DEBUG logging...\n")
+def run_embedding_debug():
+    """Embed a batch of queries against Ollama (one /api/embed request) with DEBUG logging."""
+    # Enable DEBUG logging
+    logging.basicConfig(level=logging.DEBUG, format='%(name)s - %(levelname)s - %(message)s')
+
+    print("Testing Ollama embedding with DEBUG logging...\n")
+
+    try:
+        queries = ["q1", "q2", "q3", "q4"]
+        result = embed_texts(queries, model="bge-m3")
+        if len(result) == len(queries) and len(result[0]) > 0:
+            # rows are float32 already; stack them into the (N, D) matrix that
+            # retrieval and the cache work with
+            arr = np.asarray(result, dtype=np.float32)
+            if arr.ndim != 2:
+                print(f"\n✗ Expected an (N, D) matrix, got shape {arr.shape}")
+            else:
+                print(f"\n✓ SUCCESS! {arr.shape[0]} embeddings, dimension: {arr.shape[1]}")
+        elif result:
+            print(f"\n✗ Expected {len(queries)} embeddings, got {len(result)}")
+        else:
+            print("\n✗ Empty result")
+    except Exception as e:
+        print(f"\n✗ FAILED: {e}")
+
+def probe_model_stays_warm():
+    """Second embed should be much faster than the first (model load) one.
+
+    A slow second call means Ollama reloads the model between requests (check
+    OLLAMA_KEEP_ALIVE). If the model was already loaded before this runs, both
+    calls are warm and the comparison is not meaningful.
+    """
+    print("\nWarm-model check:")
+    try:
+        t0 = time.perf_counter()
+        embed_texts(["warm"], model="bge-m3")
+        t1 = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        embed_texts(["warm"], model="bge-m3")
+        t2 = time.perf_counter() - t0
+    except Exception as e:
+        print(f"   ✗ FAILED: {e}")
+        return
+    mark = "✓" if t2 < 0.5 * t1 else "✗"
+    print(f"   {mark} first={t1*1000:.1f}ms  second={t2*1000:.1f}ms")
+    if mark == "✗":
+        print("   Model may not be staying resident (or was already warm before the first call)")
+
+def sweep_batch_sizes(batch_sizes=(1, 8, 32, 128)):
+    """Time embed_texts per batch size to pick EMBED_BATCH_SIZE for this machine.
+
+    Too small pays per-request overhead, too large risks Ollama timeouts; the
+    lowest per-item latency is the suggestion.
+    """
+    print("\nBatch size sweep:")
+    per_item = {}
+    for bs in batch_sizes:
+        # distinct texts, so nothing along the way can serve repeats
+        texts = [f"test query {i}" for i in range(bs)]
+        try:
+            t0 = time.perf_counter()
+            embed_texts(texts, model="bge-m3")
+            dt = time.perf_counter() - t0
+        except Exception as e:
+            print(f"   bs={bs:3d}  ✗ FAILED: {e}")
+            continue
+        per_item[bs] = dt / bs
+        print(f"   bs={bs:3d}  total={dt*1000:.1f}ms  per-item={dt*1000/bs:.2f}ms")
+    if per_item:
+        best = min(per_item, key=per_item.get)
+        print(f"\nRecommended: EMBED_BATCH_SIZE={best}")
 
-try:
-    result = embed_texts(["test query"], model="bge-m3")
-    if result and len(result) > 0:
-        print(f"\n✓ SUCCESS! Embedding dimension: {len(result[0])}")
-    else:
-        print("\n✗ Empty result")
-except Exception as e:
-    print(f"\n✗ FAILED: {e}")
+if __name__ == "__main__":
+    # first, so its first call is the one that loads the model
+    probe_model_stays_warm()
+    run_embedding_debug()
+    # keep the sweep's output readable
+    logging.getLogger().setLevel(logging.INFO)
+    sweep_batch_sizes()